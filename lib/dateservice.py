@@ -0,0 +1,148 @@
+# *  This Program is free software; you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License as published by
+# *  the Free Software Foundation; either version 2, or (at your option)
+# *  any later version.
+# *
+# *  This Program is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with Kodi; see the file COPYING.  If not, write to
+# *  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+# *  http://www.gnu.org/copyleft/gpl.html
+
+# Background service that keeps the database date cache warm.
+# Connecting to the immich database (TCP, TLS, SCRAM authentication) and querying it takes
+# time on every screensaver activation. When 'Get dates from database' is set, this service
+# keeps one connection open, reconnecting when needed, and refreshes the date cache in the
+# addon's userdata folder every few minutes. The screensaver then reads the dates from the
+# cache without connecting to the database at all.
+
+import os
+import sys
+import json
+import time
+from pathlib import Path
+import xbmc
+import xbmcaddon
+import xbmcvfs
+
+sys.path.insert(0, os.path.join(xbmcaddon.Addon().getAddonInfo('path'), 'modules'))
+sys.path.insert(0, os.path.join(xbmcaddon.Addon().getAddonInfo('path'), 'lib'))
+from services import DatabaseAPI
+from services import DateCache, ALL_SCOPE, FAVORITES_SCOPE, SERVICE_REFRESHED_PROPERTY, album_scope
+from services import log, set_home_prop
+
+ADDON_ID = xbmcaddon.Addon().getAddonInfo('id')
+ADDON_USERDATA_FOLDER = Path(xbmcvfs.translatePath(f"special://profile/addon_data/{ADDON_ID}"))
+ALBUMS_FILE = ADDON_USERDATA_FOLDER / "selected_albums.json"
+DATE_CACHE_FILE = ADDON_USERDATA_FOLDER / "date_cache.json"
+SCRAM_KEYS_FILE = ADDON_USERDATA_FOLDER / "database_keys.json"
+
+REFRESH_SECONDS = 10 * 60
+RETRY_SECONDS = 60
+
+class DateService():
+    def __init__(self):
+        self.Monitor = ServiceMonitor()
+        self.databaseAPI = None
+        self.connection_settings = None
+
+    def run(self):
+        try:
+            while not self.Monitor.abortRequested():
+                wait_seconds = self._refresh()
+                end = time.time() + wait_seconds
+                self.Monitor.settings_changed = False
+                while time.time() < end and not self.Monitor.settings_changed:
+                    if self.Monitor.waitForAbort(1):
+                        raise ServiceAbortException
+        except ServiceAbortException:
+            pass
+        finally:
+            self._close_database()
+
+    def _refresh(self):
+        # Returns the number of seconds to wait before the next refresh
+        addon = xbmcaddon.Addon()
+        if not addon.getSettingBool('dbdates'):
+            self._close_database()
+            return REFRESH_SECONDS
+        connection_settings = (
+            addon.getSetting('dbname'),
+            addon.getSetting('dbuser'),
+            addon.getSetting('dbpassword'),
+            addon.getSetting('dbhost'),
+            addon.getSettingInt('dbport'),
+        )
+        if connection_settings != self.connection_settings:
+            # Settings changed, so start over with a new connection
+            self._close_database()
+            self.connection_settings = connection_settings
+        # Try twice, in case the database closed the connection since the last refresh
+        for attempt in (1, 2):
+            try:
+                if self.databaseAPI is None:
+                    self.databaseAPI = DatabaseAPI(
+                        *connection_settings,
+                        ServiceAbortException,
+                        lambda: self.Monitor.abortRequested(),
+                        key_cache_file=SCRAM_KEYS_FILE
+                    )
+                # Read the cache again each time, to start from what the screensaver saved since
+                dbname, dbuser, dbpassword, dbhost, dbport = connection_settings
+                date_cache = DateCache(DATE_CACHE_FILE, f"{dbhost}:{dbport}/{dbname}")
+                for scope in self._get_scopes(addon):
+                    date_cache.refresh(scope, self.databaseAPI)
+                    if self._use_events(addon, scope):
+                        date_cache.get_events(scope, addon.getSettingInt('eventgap') * 60, addon.getSettingBool('favsOnly'), self.databaseAPI)
+                ADDON_USERDATA_FOLDER.mkdir(parents=True, exist_ok=True)
+                date_cache.save()
+                set_home_prop(SERVICE_REFRESHED_PROPERTY, str(time.time()))
+                return REFRESH_SECONDS
+            except ServiceAbortException:
+                raise
+            except Exception as e:
+                log(f"Date cache refresh failed (attempt {attempt}): {type(e).__name__} {str(e)}")
+                self._close_database()
+        return RETRY_SECONDS
+
+    def _get_scopes(self, addon):
+        # The same scopes the screensaver will ask for with the current settings
+        if addon.getSettingBool('albums'):
+            return [album_scope(album["id"]) for album in self._load_selected_albums()]
+        if addon.getSettingBool('favsOnly'):
+            # The screensaver falls back to all dates when there are no favorites
+            return [FAVORITES_SCOPE, ALL_SCOPE]
+        return [ALL_SCOPE]
+
+    def _use_events(self, addon, scope):
+        # The screensaver only uses the events of the scopes it takes its dates from
+        if not addon.getSettingBool('events') or addon.getSettingBool('onthisday'):
+            return False
+        return not (scope == ALL_SCOPE and addon.getSettingBool('favsOnly'))
+
+    def _load_selected_albums(self):
+        try:
+            data = json.loads(ALBUMS_FILE.read_text(encoding="utf-8"))
+            return data.get("albums", [])
+        except Exception:
+            return []
+
+    def _close_database(self):
+        if self.databaseAPI is not None:
+            self.databaseAPI.close()
+            self.databaseAPI = None
+
+class ServiceAbortException(Exception):
+    # Used to end the service when kodi shuts down
+    pass
+
+class ServiceMonitor(xbmc.Monitor):
+    def __init__(self, *args, **kwargs):
+        self.settings_changed = False
+
+    def onSettingsChanged(self):
+        self.settings_changed = True
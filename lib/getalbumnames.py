@@ -67,7 +67,7 @@ def dialog_multiselect(title, items, preselect=None):
     return sorted(selected)
 
 def save_albums(selected):
-    albums = {"albums": [{"albumName": a.get("albumName", ""), "id": a["id"]} for a in selected]}
+    albums = {"albums": [{"albumName": a.get("albumName", ""), "id": a["id"], "assetCount": a.get("assetCount", 0)} for a in selected]}
     data = json.dumps(albums, ensure_ascii=False)
     ALBUMS_FILE.write_text(data, encoding="utf-8")
 
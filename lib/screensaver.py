@@ -53,6 +53,15 @@
 #        This allows each date to be chosen with the same probability, rather than
 #        dates with more pictures being chosen more frequently. Requires you to set
 #        up direct access to the immich database.
+#    12. There is an 'On this day' option, that only shows pictures taken on today's
+#        date in earlier years, using the days around it when there are only a few.
+#    13. With dates from the database, pictures can be chosen by event instead of by date:
+#        pictures taken close together in time, even when they go past midnight.
+#    14. The show can be limited to a range of years, or the last few years, and recent
+#        dates can be chosen more often.
+#    15. The stacks made in immich can be used as the burst groups.
+#    16. Pictures that look almost the same as one taken shortly before can be skipped.
+#    17. While a picture is slow to download, a blurred version of it is shown.
 
 import xbmc
 import xbmcgui
@@ -61,32 +70,75 @@ import xbmcvfs
 
 import os
 import sys
+import math
 import random
 import time
+import itertools
+import heapq
 import json
-from datetime import datetime
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as SlideTimeout
 from pathlib import Path
-from iptcinfo3 import IPTCInfo
-# Turn off all the warnings from IPTCInfo
-import logging
-logging.getLogger("iptcinfo").setLevel(logging.ERROR)
 sys.path.insert(0, os.path.join(sys.path[0], 'modules'))
 import imagesize
 
 sys.path.insert(0, os.path.join(xbmcaddon.Addon().getAddonInfo('path'), 'lib'))
 from services import ImmichAPI
 from services import DatabaseAPI
-from services import log, notify
+from services import DateRotations, WeightedDates
+from services import EmptyDates
+from services import AliasSampler
+from services import OnThisDay, month_days_around
+from services import EventIndex, merge_events
+from services import DateRange, RecentDates
+from services import SessionRecorder, SessionReplay
+from services import burst_ranges, iter_bursts, taken_ms, BURST_GAP_MS
+from services import PageLoader
+from services import NearDuplicates, write_png
+from services import read_iptc, HeaderParser
+from services import MetadataCache
+from services import DateCache, ALL_SCOPE, FAVORITES_SCOPE, SERVICE_REFRESHED_PROPERTY, album_scope
+from services import IMAGES, FAVORITE_IMAGES
+from services import log, notify, get_home_prop
 
 ADDON = xbmcaddon.Addon()
 ADDON_ID = ADDON.getAddonInfo('id')
 ADDON_USERDATA_FOLDER = Path(xbmcvfs.translatePath(f"special://profile/addon_data/{ADDON_ID}"))
 IMMICH_TEMP_FILE_EXTENSION = '.immich-tmp'
 ALBUMS_FILE = ADDON_USERDATA_FOLDER / "selected_albums.json"
+DATE_CACHE_FILE = ADDON_USERDATA_FOLDER / "date_cache.json"
+SCRAM_KEYS_FILE = ADDON_USERDATA_FOLDER / "database_keys.json"
+# Scope name used to remember the rotation through the combined dates of all selected albums
+ALBUM_UNION_SCOPE = "albums"
+DATE_ROTATION_FILE = ADDON_USERDATA_FOLDER / "date_rotation.json"
+EMPTY_DATES_FILE = ADDON_USERDATA_FOLDER / "empty_dates.json"
+TRACE_FILE = ADDON_USERDATA_FOLDER / "session_trace.jsonl"
+METADATA_CACHE_FILE = ADDON_USERDATA_FOLDER / "metadata_cache.sqlite"
+# The date cache is trusted without checking the database if the background service refreshed it this recently
+SERVICE_CACHE_MAX_AGE = 30 * 60
 
 # Formats that can be displayed in a slideshow
 PICTURE_FORMATS = ('bmp', 'jpeg', 'jpg', 'gif', 'png', 'tiff', 'mng', 'ico', 'pcx', 'tga', 'heic', 'heif')
 MAX_CONSECUTIVE_EMPTY_DATES = 25
+# Pictures in each page of a search
+SEARCH_PAGE_SIZE = 1000
+# With a limit on the number of groups, dates with more pictures than this are fetched a page
+# of this size at a time, from a random picture on, instead of all at once
+WINDOW_PAGE_SIZE = 250
+# How often each album is used: the same for all albums, by album size, or by the square root of album size
+ALBUM_WEIGHT_UNIFORM = 0
+ALBUM_WEIGHT_SIZE = 1
+ALBUM_WEIGHT_SQRT_SIZE = 2
+# How far from today's date 'On this day' looks when there are no pictures on the day itself
+ON_THIS_DAY_MAX_WINDOW_DAYS = 7
+# How many dates already known to have nothing to display are skipped before asking immich anyway
+MAX_KNOWN_EMPTY_DATE_SKIPS = 100
+# Session trace: off, record the dates shown, or show the recorded dates again
+TRACE_OFF = 0
+TRACE_RECORD = 1
+TRACE_REPLAY = 2
+# Seconds a download may take before the blurred thumbhash of the picture is shown in its place
+PLACEHOLDER_DELAY = 0.3
 EXCEPTION_TYPE_NOT_HANDLED = 30940
 
 class Screensaver(xbmcgui.WindowXMLDialog):
@@ -101,24 +153,23 @@ class Screensaver(xbmcgui.WindowXMLDialog):
             self._set_ui_controls()
             self._initialize_immich()
             self._validate_settings()
+            self._load_empty_dates()
+            self._start_trace()
+            # What was read from the files of the pictures shown before
+            ADDON_USERDATA_FOLDER.mkdir(parents=True, exist_ok=True)
+            self.metadata_cache = MetadataCache(METADATA_CACHE_FILE)
             if (self.setting_dbdates):
                 # Asked to get unique date lists from the database, so try to get them
                 try:
-                    self.databaseAPI = DatabaseAPI(
-                        self.setting_dbname,
-                        self.setting_dbuser,
-                        self.setting_dbpassword,
-                        self.setting_dbhost,
-                        self.setting_dbport,
-                        ScreensaverAbortException,
-                        lambda: self.Monitor.abortRequested()
-                    )
+                    if not self._service_cache_is_fresh():
+                        self._connect_database()
                     self._get_db_dates()
+                except ScreensaverAbortException:
+                    raise
                 except Exception as e:
                     log(f"Database access failed: {e}")
                     log("Falling back to api access for dates")
                     self.setting_dbdates = False
-                    self.databaseAPI.close()
             # Done with all of the initializations
             self._start_show()
         except ScreensaverAbortException:
@@ -130,10 +181,22 @@ class Screensaver(xbmcgui.WindowXMLDialog):
             notify(ADDON.getLocalizedString(EXCEPTION_TYPE_NOT_HANDLED),{str(e)})
         finally:
             # Close the Database on exit
-            if (self.setting_dbdates):
+            if self.databaseAPI is not None:
                 self.databaseAPI.close()
+            # Remember which dates have been shown, so the next activation carries on from here
+            if self.date_rotations is not None:
+                self.date_rotations.save()
+            # Remember which dates had nothing to show
+            if self.empty_dates is not None:
+                self.empty_dates.save()
+            if self.recorder is not None:
+                self.recorder.close()
+            if self.metadata_cache is not None:
+                self.metadata_cache.close()
             # Close the api sessions on exit
             self.immichapi.close() 
+            if self.slide_worker is not None:
+                self.slide_worker.shutdown(wait=False)
              # Delete any temporary image files that have been retrieved
             self._delete_temporary_files(exiting=True)
             # Close everything
@@ -150,6 +213,11 @@ class Screensaver(xbmcgui.WindowXMLDialog):
         self.setting_music = ADDON.getSettingBool('music')
         self.setting_clock = ADDON.getSettingBool('clock')
         self.setting_burst = ADDON.getSettingBool('burst')
+        self.setting_stacks = ADDON.getSettingBool('stacks')
+        self.setting_duplicates = ADDON.getSettingInt('duplicates')
+        self.setting_placeholders = ADDON.getSettingBool('placeholders')
+        # With stacks, immich has already grouped the bursts, so every stack or picture is a group of its own
+        self.burst_gap_ms = -1 if self.setting_stacks else BURST_GAP_MS
         self.setting_panorama = ADDON.getSettingBool('panorama')
         self.setting_kenburns = ADDON.getSettingBool('kenburns')
         # convert float to hex value usable by the skin
@@ -160,12 +228,37 @@ class Screensaver(xbmcgui.WindowXMLDialog):
         self.setting_dbname = ADDON.getSetting('dbname')
         self.setting_dbuser = ADDON.getSetting('dbuser')
         self.setting_dbpassword = ADDON.getSetting('dbpassword')
+        self.setting_dateweight = ADDON.getSettingInt('dateweight')
+        self.setting_mingroup = ADDON.getSettingInt('mingroup')
         self.setting_favsOnly = ADDON.getSettingBool('favsOnly')
         self.setting_albums = ADDON.getSettingBool('albums')
         self.setting_albumname  = ADDON.getSettingBool('albumname')
+        self.setting_albumunion = ADDON.getSettingBool('albumunion')
+        self.setting_albumweight = ADDON.getSettingInt('albumweight')
+        self.setting_onthisday = ADDON.getSettingBool('onthisday')
+        self.setting_events = ADDON.getSettingBool('events')
+        self.setting_eventgap = ADDON.getSettingInt('eventgap')
+        self.date_range = DateRange(
+            ADDON.getSettingInt('daterange'),
+            ADDON.getSettingInt('fromyear'),
+            ADDON.getSettingInt('toyear'),
+            ADDON.getSettingInt('lastyears'),
+            ADDON.getSettingInt('recency') / 100.0
+        )
+        self.oldest_dates = {}
         self.setting_usePreview = ADDON.getSettingBool('usePreview')
+        self.setting_trace = ADDON.getSettingInt('trace')
+        self.setting_traceseed = ADDON.getSettingInt('traceseed')
         self.empty_date_count = 0
-        self.offset_adjustment = 0
+        # Set here, so everything the finally in onInit looks at exists even if starting up fails
+        self.databaseAPI = None
+        self.date_rotations = None
+        self.slide_worker = None
+        self.empty_dates = None
+        self.recorder = None
+        self.metadata_cache = None
+        self.replay = None
+        self.on_this_day_years = {}
         
     def _set_ui_controls(self):
         # Get the screensaver window id
@@ -181,6 +274,9 @@ class Screensaver(xbmcgui.WindowXMLDialog):
             self._set_prop('Clock', 'show')
         # Set the skin name so we can have different looks for different skins
         self._set_prop('SkinName',xbmc.getSkinDir())
+        # The animations are worked out in the slide worker, so get the screen size here
+        self.screen_w = self.winid.getWidth()
+        self.screen_h = self.winid.getHeight()
 
     def _initialize_immich(self):
         self.immichapi = ImmichAPI(
@@ -189,15 +285,16 @@ class Screensaver(xbmcgui.WindowXMLDialog):
             ScreensaverAbortException,
             lambda: self.Monitor.abortRequested()
         )
+        # Slides are prepared in the background, while the slide before them is shown
+        self.slide_worker = ThreadPoolExecutor(max_workers=1)
 
     def _validate_settings(self):
         # If use albums is specified, make sure some albums were selected
         if (self.setting_albums):
             self.albumlist = self.load_selected_albums()
             if self.albumlist:
-                self.albumindices = list(range(len(self.albumlist)))
-                random.shuffle(self.albumindices)
-                self.albumindex = 0
+                self._get_album_sizes()
+                self._make_album_sampler()
             else:
                 # No albums were found
                 log("'Use Albums' is set but there are no albums selected. Setting value to False")
@@ -211,6 +308,52 @@ class Screensaver(xbmcgui.WindowXMLDialog):
                 log("'Only Display Favorites' is set but there are no favorite images. Setting value to False")
                 self.setting_favsOnly = False
     
+    def _get_album_sizes(self):
+        # Albums selected with older versions don't have their size saved
+        if self.setting_albumweight == ALBUM_WEIGHT_UNIFORM or all("assetCount" in album for album in self.albumlist):
+            return
+        sizes = {album["id"]: album.get("assetCount", 0) for album in (self.immichapi.get_albums() or [])}
+        for album in self.albumlist:
+            album["assetCount"] = sizes.get(album["id"], 0)
+
+    def _make_album_sampler(self):
+        # Decide how often each album is used
+        sizes = [album.get("assetCount", 0) for album in self.albumlist]
+        if self.setting_albumweight == ALBUM_WEIGHT_SIZE:
+            weights = sizes
+        elif self.setting_albumweight == ALBUM_WEIGHT_SQRT_SIZE:
+            weights = [math.sqrt(size) for size in sizes]
+        else:
+            weights = [1] * len(sizes)
+        self.album_sampler = AliasSampler(weights)
+
+    def _start_trace(self):
+        # Record the session, or show a recorded one again. Either way the random choices start from
+        # a fixed seed, so the same slides get the same animations.
+        self.trace_started = time.time()
+        seed = self.setting_traceseed
+        if self.setting_trace == TRACE_REPLAY:
+            try:
+                self.replay = SessionReplay(TRACE_FILE)
+                seed = self.replay.seed
+            except Exception as e:
+                log(f"Can't replay the session trace, showing a new session: {type(e).__name__} {str(e)}")
+        elif self.setting_trace == TRACE_RECORD:
+            ADDON_USERDATA_FOLDER.mkdir(parents=True, exist_ok=True)
+            self.recorder = SessionRecorder(TRACE_FILE, seed)
+        if self.setting_trace != TRACE_OFF:
+            random.seed(seed)
+            self.animation_rng = random.Random(seed)
+        else:
+            self.animation_rng = random
+
+    def _load_empty_dates(self):
+        # Dates known to have nothing to display are only valid while the library stays the same
+        fingerprint = [self.immichapi.get_statistics()]
+        if self.setting_favsOnly:
+            fingerprint.append(self.immichapi.get_statistics(isFavorite=True))
+        self.empty_dates = EmptyDates(EMPTY_DATES_FILE, json.dumps(fingerprint, sort_keys=True))
+
     def load_selected_albums(self):
         if not ALBUMS_FILE.exists():
             return []
@@ -220,54 +363,196 @@ class Screensaver(xbmcgui.WindowXMLDialog):
         except Exception:
             return []
 
+    def _service_cache_is_fresh(self):
+        # The background service keeps the date cache up to date, so there is no need to connect
+        refreshed = get_home_prop(SERVICE_REFRESHED_PROPERTY)
+        return bool(refreshed) and (time.time() - float(refreshed)) < SERVICE_CACHE_MAX_AGE
+
+    def _connect_database(self):
+        self.databaseAPI = DatabaseAPI(
+            self.setting_dbname,
+            self.setting_dbuser,
+            self.setting_dbpassword,
+            self.setting_dbhost,
+            self.setting_dbport,
+            ScreensaverAbortException,
+            lambda: self.Monitor.abortRequested(),
+            key_cache_file=SCRAM_KEYS_FILE
+        )
+
+    def _get_scope_dates(self, scope):
+        # Use the cache as is when it's kept fresh by the service, otherwise bring it up to date
+        if self.databaseAPI is None:
+            counts = self.date_cache.get(scope)
+            if counts is not None:
+                return counts
+            # The service hasn't loaded this scope yet
+            self._connect_database()
+        return self.date_cache.refresh(scope, self.databaseAPI)
+
     def _get_db_dates(self):
+        # The dates are kept in userdata between activations, and only the changes are queried
+        source = f"{self.setting_dbhost}:{self.setting_dbport}/{self.setting_dbname}"
+        self.date_cache = DateCache(DATE_CACHE_FILE, source)
+        self.date_rotations = DateRotations(DATE_ROTATION_FILE, source)
         if self.setting_albums:
             # get a list of all the distinct dates for each album
             self.db_album_dates = self._get_db_album_dates(self.albumlist)
-        else:
+        if self.setting_albums and self.setting_albumunion:
+            # All of the dates from all of the albums in one list
+            self.album_union_dates = self._make_date_index(ALBUM_UNION_SCOPE, self._get_album_union_counts())
+        if not self.setting_albums:
             # get a list of all the distinct dates of the images
             self.distinct_dates = self._get_db_distinct_dates()
-            # At the start of the show, use the first random date
-            self.distinct_date_index = 0
+        if self._use_events():
+            self._get_db_events()
+        self.date_cache.save()
+
+    def _get_db_events(self):
+        # Events for the same scopes as the dates
+        if self.setting_albums:
+            album_events = {album["id"]: self._get_scope_events(album_scope(album["id"])) for album in self.albumlist}
+            self.db_album_events = {
+                albumId: EventIndex(events, self.setting_mingroup, self.date_range)
+                for albumId, events in album_events.items()
+            }
+            if self.setting_albumunion:
+                self.album_union_events = EventIndex(
+                    merge_events(album_events.values(), self.setting_eventgap * 60),
+                    self.setting_mingroup,
+                    self.date_range
+                )
+        else:
+            scope = FAVORITES_SCOPE if self.setting_favsOnly else ALL_SCOPE
+            self.distinct_events = EventIndex(self._get_scope_events(scope), self.setting_mingroup, self.date_range)
+
+    def _get_scope_events(self, scope):
+        # Like the dates, the events come from the cache when the service keeps it fresh
+        events = self.date_cache.get_events(scope, self.setting_eventgap * 60, self.setting_favsOnly, self.databaseAPI)
+        if events is None:
+            # The service hasn't worked out the events for these settings yet
+            self._connect_database()
+            events = self.date_cache.get_events(scope, self.setting_eventgap * 60, self.setting_favsOnly, self.databaseAPI)
+        return events
 
     def _get_db_album_dates(self, albumlist):
-        # for each album query for a list of unique dates in that album
+        # for each album get the list of unique dates in that album
         result = {}
+        self.album_image_counts = {}
         for album in albumlist:
             albumId = album["id"]
-            query = f"""
-                SELECT DISTINCT DATE(a."fileCreatedAt")
-                FROM album_asset aa
-                JOIN asset a ON a."id" = aa."assetId"
-                WHERE aa."albumId" = '{albumId}';
-            """
-            rows = self.databaseAPI.exec_query(query)
-            dates = [d for (d,) in rows]
-            random.shuffle(dates)
-            result[albumId] = {"date_index":0, "date_list": dates}
+            scope = album_scope(albumId)
+            self.album_image_counts[albumId] = self._get_image_counts(self._get_scope_dates(scope))
+            result[albumId] = self._make_date_index(scope, self.album_image_counts[albumId])
+        # Albums without any pictures to display (e.g. no favorites) can't be used
+        self.albumlist = [album for album in albumlist if len(result[album["id"]]) > 0]
+        for album in self.albumlist:
+            # The database knows how many of the album's pictures can be displayed
+            album["assetCount"] = sum(self.album_image_counts[album["id"]].values())
+        self._make_album_sampler()
+        if not self.albumlist:
+            log("None of the selected albums have pictures to display. Setting 'Use Albums' to False")
+            self.setting_albums = False
         return result
 
+    def _get_album_union_counts(self):
+        # A date is in the union if it is in any of the albums. Pictures in more than one album are counted for each album.
+        union_counts = {}
+        for album in self.albumlist:
+            for d, count in self.album_image_counts[album["id"]].items():
+                union_counts[d] = union_counts.get(d, 0) + count
+        return union_counts
+
     def _get_db_distinct_dates(self):
         # Get a list of all the distinct dates of the images
         if self.setting_favsOnly:
             # Only get dates that contain favorites so we don't pick lots of days with no pictures to display
-            query = ' SELECT DISTINCT DATE("fileCreatedAt") FROM asset WHERE "isFavorite" = TRUE; '
-            distinct_dates = list(self.databaseAPI.exec_query(query))
+            distinct_dates = self._make_date_index(FAVORITES_SCOPE, self._get_image_counts(self._get_scope_dates(FAVORITES_SCOPE)))
             if len(distinct_dates) == 0:
                 # There were NO dates found that had favorites, so don't limit pictures to favorites only
                 self.setting_favsOnly = False
                 log("'Only Display Favorites' is set but there are no favorite images. Setting value to False")
         if not self.setting_favsOnly:
-            query = ' SELECT DISTINCT DATE("fileCreatedAt") FROM asset; '
-            distinct_dates = list(self.databaseAPI.exec_query(query))
-        # Randomize the order that the date groups will be shown
-        random.shuffle(distinct_dates)
+            distinct_dates = self._make_date_index(ALL_SCOPE, self._get_image_counts(self._get_scope_dates(ALL_SCOPE)))
+        if len(distinct_dates) == 0 and self.date_range.first is not None:
+            log("There are no pictures in the selected date range. Using all dates")
+            self.date_range = DateRange(recency=self.date_range.recency)
+            distinct_dates = self._make_date_index(ALL_SCOPE, self._get_image_counts(self._get_scope_dates(ALL_SCOPE)))
+        if len(distinct_dates) == 0 and self.setting_mingroup > 1:
+            log(f"No dates have {self.setting_mingroup} or more pictures to display. Using dates with any number of pictures")
+            self.setting_mingroup = 1
+            distinct_dates = self._make_date_index(ALL_SCOPE, self._get_image_counts(self._get_scope_dates(ALL_SCOPE)))
         return distinct_dates
 
+    def _get_image_counts(self, counts):
+        # The number of pictures that can be displayed on each date. With 'Only display favorites',
+        # only favorites count, so an album's dates are those that have favorites in the album.
+        column = FAVORITE_IMAGES if self.setting_favsOnly else IMAGES
+        return {d: c[column] for d, c in counts.items() if c[column] > 0}
+
+    def _make_date_index(self, scope, image_counts):
+        # Only use dates with enough pictures to display
+        image_counts = {d: count for d, count in image_counts.items() if count >= self.setting_mingroup}
+        if self.date_range.first is not None:
+            # Only dates in the selected years
+            image_counts = {d: image_counts[d] for d in self.date_range.select(sorted(image_counts))}
+        if self.setting_onthisday:
+            # Only dates from earlier years on (or around) today's date
+            return OnThisDay(image_counts)
+        if self.date_range.recency > 0:
+            # Recent dates are chosen more often
+            return RecentDates(image_counts, self.date_range)
+        if self.setting_dateweight > 0:
+            # Dates with more pictures are chosen more often
+            return WeightedDates(image_counts, self.setting_dateweight / 100.0)
+        # The index hands out the dates in random order, carrying on from the last activation
+        return self.date_rotations.get_index(scope, image_counts)
+
     def _start_show(self):
         # start with first image control
         control_index = 0
-        # loop until onScreensaverDeactivated is called
+        pictures = self._iter_pictures()
+        # The next slide is prepared (downloaded, its info read and its animation worked out) by the
+        # slide worker while the one before it is on screen
+        upcoming = self._prepare_next(pictures)
+        while upcoming is not None:
+            # break if onScreensaverDeactivated is called
+            if self.Monitor.abortRequested():
+                raise ScreensaverAbortException
+            slide = self._wait_for_slide(upcoming, control_index)
+            if slide is None:
+                #download failed, go to next image
+                upcoming = self._prepare_next(pictures)
+                continue
+
+            if slide.transition:
+                # Add background image to gui
+                self.background_controls[control_index].setImage(slide.path, False)
+                self._set_prop('Background', str(control_index))
+                # Add image info to slide
+                self._set_info_fields(slide.info, control_index)
+                self._set_prop('Info', str(control_index))
+
+            # Show the slide with animations
+            self.image_controls[control_index].setImage(slide.path, False)
+            self.image_controls[control_index].setAnimations(slide.animation)
+            # About to show images, so turn off splash screen
+            self._set_prop('Splash', 'hide')
+            shown = time.monotonic()
+
+            # Only now move on to the next picture, which can mean searching the next date
+            upcoming = self._prepare_next(pictures)
+
+            # display the image for the specified amount of time, counting the time taken to move on
+            if self.Monitor.waitForAbort(max(0, slide.duration / 1000 - (time.monotonic() - shown))):
+                raise ScreensaverAbortException
+
+            # swap to next image control
+            control_index = 0 if control_index == 1 else 1
+
+    def _iter_pictures(self):
+        # Each picture to show, with whether it is in a fast burst and where in its group it is,
+        # until onScreensaverDeactivated is called
         while (not self.Monitor.abortRequested()):
             # Get a bunch of images from the same date
             image_groupings = self._get_image_groupings()
@@ -275,125 +560,380 @@ class Screensaver(xbmcgui.WindowXMLDialog):
                 # an image_group is all pictures taken within 2 seconds of each other
                 fastmode = True if (len(image_group) > 2 and self.setting_burst) else False
                 for image in image_group:
-                    # break if onScreensaverDeactivated is called
-                    if self.Monitor.abortRequested():
-                        raise ScreensaverAbortException
-
-                    # download the image
-                    image['local_path'] = self._get_local_filename_for_image(image)
-                    if not self.immichapi.download_file(image['id'], image['local_path'], image['originalMimeType'], self.setting_usePreview):
-                        #download failed, go to next image
-                        continue
-
-                    # logic to skip transitions when in fastmode
-                    first_in_group = image is image_group[0]
-                    last_in_group  = image is image_group[-1]
-                    if not fastmode or (fastmode and (first_in_group or last_in_group)):
-                        # Add background image to gui
-                        self.background_controls[control_index].setImage(image['local_path'], False)
-                        self._set_prop('Background', str(control_index))
-                        # assign all of the requested and available info to the image
-                        info = self._get_image_info(image)
-                        image.update(info)
-                        # Add image info to slide
-                        self._set_info_fields(image, control_index)
-                        self._set_prop('Info', str(control_index))
-
-                    # Show the slide with animations
-                    self.image_controls[control_index].setImage(image['local_path'], False)
-                    timetowait, animation = self.get_animimation(image, fastmode, first_in_group, last_in_group)
-                    self.image_controls[control_index].setAnimations(animation)
-                    # About to show images, so turn off splash screen
-                    self._set_prop('Splash', 'hide')
-
-                    # display the image for the specified amount of time
-                    if self.Monitor.waitForAbort(timetowait / 1000):
-                        raise ScreensaverAbortException
-
-                    # swap to next image control
-                    control_index = 0 if control_index == 1 else 1
+                    yield image, fastmode, image is image_group[0], image is image_group[-1]
+
+    def _prepare_next(self, pictures):
+        # Starts preparing the next picture. None when there are no more.
+        picture = next(pictures, None)
+        if picture is None:
+            return None
+        return picture, self.slide_worker.submit(self._prepare_slide, *picture)
+
+    def _prepare_slide(self, image, fastmode, first_in_group, last_in_group):
+        # Runs in the slide worker. None if the download failed.
+        image['local_path'] = self._get_local_filename_for_image(image)
+        # A picture shown before needs no parsing at all. Otherwise the size and IPTC fields are read from
+        # the download as it arrives, when it is a JPEG or PNG.
+        metadata = self.metadata_cache.get(image['id'], image['checksum'], self.setting_usePreview)
+        cached = metadata is not None
+        headers = None if cached else HeaderParser()
+        if not self.immichapi.download_file(image['id'], image['local_path'], image['originalMimeType'], self.setting_usePreview, headers):
+            return None
+        if not cached:
+            metadata = {'size': headers.size, 'iptc': headers.iptc}
+        image.update(metadata)
+        # logic to skip transitions when in fastmode
+        transition = not fastmode or (fastmode and (first_in_group or last_in_group))
+        info = {}
+        if transition:
+            # assign all of the requested and available info to the image
+            image.update(self._get_image_info(image))
+            info = self._get_info_fields(image)
+        duration, animation = self.get_animimation(image, fastmode, first_in_group, last_in_group)
+        # Remember what was read from the download or the file, for the next time the picture is shown
+        if not cached or image['size'] != metadata['size'] or image['iptc'] != metadata['iptc']:
+            self.metadata_cache.put(image['id'], image['checksum'], self.setting_usePreview, {'size': image['size'], 'iptc': image['iptc']})
+        return Slide(image['local_path'], transition, info, duration, animation)
+
+    def _wait_for_slide(self, upcoming, control_index):
+        (image, fastmode, first_in_group, last_in_group), preparing = upcoming
+        try:
+            return preparing.result(timeout=PLACEHOLDER_DELAY)
+        except SlideTimeout:
+            pass
+        # Slow download: show the picture blurred in the background until it arrives, then it fades in as usual
+        if self.setting_placeholders and (not fastmode or first_in_group or last_in_group):
+            self._show_placeholder(image, control_index)
+        while not preparing.done():
+            if self.Monitor.waitForAbort(0.1):
+                raise ScreensaverAbortException
+        return preparing.result()
 
     def _get_image_groupings(self, update=False):    
-        all_images_for_date = self._fetch_images_for_date()
+        args, albums = self._choose_search()
+        if self.setting_limit == 0:
+            # Every group is shown, so start showing them as soon as the first page arrives
+            return self._streamed(0, self._iter_groups(args, albums))
+        if len(albums) == 1:
+            # Only part of a big date is shown, so only fetch that part
+            total = self.immichapi.search_statistics(self._stream_args(args, albums[0]))
+            if total > WINDOW_PAGE_SIZE:
+                return self._get_windowed_groupings(args, albums[0], total)
+        all_images_for_date = self._search_albums(args, albums)
         if len(all_images_for_date) == 0:
             # No displayable pictures found for this date
-            self.empty_date_count +=1
-            if self.empty_date_count > MAX_CONSECUTIVE_EMPTY_DATES:
-                log(f"Made {MAX_CONSECUTIVE_EMPTY_DATES} date attempts with no images. Aborting")
-                raise ScreensaverAbortException
+            self._finish_date(0, [])
             return []
-        self.empty_date_count = 0
-        image_groupings = self._group_images(all_images_for_date)
+        image_groupings = list(self._distinct(self._group_images(all_images_for_date)))
         # Return the requested number of pictures
-        if self.setting_limit == 0 or (len(image_groupings) <= self.setting_limit):
+        if len(image_groupings) <= self.setting_limit:
             # Fewer picture for this date than max allowed, so display them all
-            return image_groupings
+            offset = 0
         else:
             # More pictures on this date than the max allowed
             # Set a random offset into the list of pictures so we don't always start wtih the earliest picture on the date.
             offset = random.randrange(len(image_groupings) - self.setting_limit)
-            if self.offset_adjustment != 0:
-                offset = self.offset_adjustment
-            return image_groupings[offset:offset+self.setting_limit]
+            if self.replay is not None:
+                offset = self.replay_entry["offset"]
+            image_groupings = image_groupings[offset:offset+self.setting_limit]
+        return self._streamed(offset, image_groupings)
+
+    def _get_windowed_groupings(self, args, album, total):
+        # Pick the random offset first, as a picture rather than a group, since the number of pictures is
+        # all that is known without fetching them. Then fetch the pages in time order from there, making
+        # groups until there are enough.
+        offset = random.randrange(total - self.setting_limit)
+        if self.replay is not None:
+            offset = self.replay_entry["offset"]
+        seen_ids = set()
+        # No pages are fetched ahead, so nothing past the last group shown is fetched
+        images = self._iter_images(args, album, seen_ids, WINDOW_PAGE_SIZE, offset, read_ahead=False)
+        try:
+            image_groupings = list(itertools.islice(self._bursts(images), self.setting_limit))
+        finally:
+            # Stop the search
+            images.close()
+        if len(image_groupings) < self.setting_limit:
+            # Near the end of the date the pictures after the offset can make fewer groups than the limit
+            # (bursts, near-duplicates), so add the groups just before them
+            image_groupings = self._groups_before(args, album, offset, seen_ids, self.setting_limit - len(image_groupings)) + image_groupings
+        return self._streamed(offset, image_groupings)
+
+    def _groups_before(self, args, album, offset, seen_ids, count):
+        # The last count groups of the pictures before the offset that haven't been used yet, fetching
+        # the pages from the offset backwards only until there are enough
+        earlier_images = []
+        image_groupings = []
+        page = offset // WINDOW_PAGE_SIZE + 1
+        while len(image_groupings) < count and page >= 1:
+            images = []
+            self._add_displayable_images(self._get_page(args, album, page), album, seen_ids, images)
+            earlier_images = images + earlier_images
+            image_groupings = list(self._bursts(earlier_images))
+            page -= 1
+        return image_groupings[-count:]
 
-    def _fetch_images_for_date(self):
+    def _get_page(self, args, album, page):
+        pages = self.immichapi.search_metadata(self._stream_args(args, album), page_size=WINDOW_PAGE_SIZE, page=page)
+        try:
+            return next(pages, [])
+        finally:
+            pages.close()
+
+    def _bursts(self, images):
+        # The groups of pictures in time order, without near-duplicates
+        return self._distinct(self._make_group(image_group) for image_group in iter_bursts(images, self.burst_gap_ms))
+
+    def _iter_groups(self, args, albums):
+        # The groups of all of the pictures, in time order. The albums are searched side by side
+        # and their pictures merged by time.
+        seen_ids = set()
+        streams = [self._iter_images(args, album, seen_ids) for album in albums]
+        images = streams[0] if len(streams) == 1 else heapq.merge(*streams, key=lambda image: image["takenMs"])
+        return self._bursts(images)
+
+    def _distinct(self, image_groupings):
+        # Leave out groups that look almost the same as one shortly before them, going by the thumbhash
+        # of their first pictures, so the near-duplicates are never downloaded
+        if self.setting_duplicates == 0:
+            return image_groupings
+        near_duplicates = NearDuplicates(self.setting_duplicates)
+        return (image_group for image_group in image_groupings if not near_duplicates.is_duplicate(image_group[0]))
+
+    def _iter_images(self, args, album, seen_ids, page_size=SEARCH_PAGE_SIZE, offset=0, read_ahead=True):
+        # The displayable pictures from the offset picture on, in time order. With read_ahead the
+        # following pages load in the background, otherwise each page is fetched when it is needed.
+        # The background pages are fetched with a session of their own, since the UI thread keeps using the api
+        session = self.immichapi.new_session() if read_ahead else None
+        pages = self.immichapi.search_metadata(self._stream_args(args, album), page_size=page_size, page=offset // page_size + 1, session=session)
+        if read_ahead:
+            pages = PageLoader(pages, ScreensaverAbortException, lambda: self.Monitor.abortRequested())
+        stop = pages.stop if read_ahead else pages.close
+        try:
+            start = offset % page_size
+            first_page = True
+            for page in pages:
+                if first_page and offset > 0 and not page:
+                    # The offset went past the end: the count included stacked pictures that the search
+                    # leaves out, or pictures were removed since. Start from the beginning instead.
+                    stop()
+                    yield from self._iter_images(args, album, seen_ids, page_size, read_ahead=read_ahead)
+                    return
+                first_page = False
+                if start > 0 and page:
+                    # Go back to the start of the burst the offset picture is in, so the first group is whole
+                    start = min(start, len(page) - 1)
+                    while start > 0 and 0 <= taken_ms(page[start]["localDateTime"]) - taken_ms(page[start - 1]["localDateTime"]) <= self.burst_gap_ms:
+                        start -= 1
+                    page = page[start:]
+                start = 0
+                images = []
+                self._add_displayable_images(page, album, seen_ids, images)
+                yield from images
+        finally:
+            stop()
+            if session is not None:
+                session.close()
+
+    def _stream_args(self, args, album):
+        # Search arguments for pictures in time order, so groups can be made as the pages arrive
+        stream_args = {**args, "type": "IMAGE", "order": "asc"}
+        if self.setting_stacks:
+            stream_args["withStacked"] = True
+        if album is not None:
+            stream_args["albumIds"] = [album["id"]]
+        return stream_args
+
+    def _streamed(self, offset, image_groupings):
+        # Hands out the groups as they are shown, and finishes the date once they all have been
+        shown = []
+        for image_group in image_groupings:
+            image_group = self._expand_stack(image_group)
+            shown.append(image_group)
+            yield image_group
+        self._finish_date(offset, shown)
+
+    def _expand_stack(self, image_group):
+        # A stack is shown as its primary picture, unless burst mode needs all of its pictures.
+        # They are only fetched now, when the stack is about to be shown.
+        image = image_group[0]
+        if not (self.setting_burst and len(image_group) == 1 and image.get("stackCount", 0) > 1):
+            return image_group
+        stack = self.immichapi.get_stack(image["stackId"])
+        stack_images = []
+        album = {"albumName": image["albumName"]} if "albumName" in image else None
+        self._add_displayable_images(stack.get("assets", []), album, set(), stack_images)
+        if not stack_images:
+            return image_group
+        stack_images.sort(key=lambda x: (x["takenMs"], x["originalFileName"]))
+        return stack_images
+
+    def _finish_date(self, offset, image_groupings):
+        self._update_empty_dates(len(image_groupings) > 0)
+        if len(image_groupings) == 0:
+            self.empty_date_count +=1
+            if self.empty_date_count > MAX_CONSECUTIVE_EMPTY_DATES:
+                log(f"Made {MAX_CONSECUTIVE_EMPTY_DATES} date attempts with no images. Aborting")
+                raise ScreensaverAbortException
+        else:
+            self.empty_date_count = 0
+        self._trace(offset, image_groupings)
+
+    def _trace(self, offset, image_groupings):
+        # Record what is about to be shown, or check it against the recording
+        assets = [image["id"] for image_group in image_groupings for image in image_group]
+        if self.recorder is not None:
+            self.recorder.record({**self.chosen_range, "offset": offset, "assets": assets})
+        if self.replay is not None:
+            self.replay.check(assets)
+
+    def _choose_search(self):
+        # Choose the time range and the albums to search, and return the search arguments and the albums
+        # (None for the whole library)
         args = {}
         if self.setting_favsOnly:
             args["isFavorite"] = True
-        if self.setting_albums:
-            self.current_album = self.albumlist[self.albumindices[self.albumindex]]
-            self.albumindex += 1
-            if self.albumindex == len(self.albumindices):
-                random.shuffle(self.albumindices)
-                self.albumindex = 0
-            args["albumIds"] = [self.current_album["id"]]
-        date = self._get_random_date()
-        args["takenAfter"] = f"{date}T00:00:00.000Z"
-        args["takenBefore"] = f"{date}T23:59:59.999Z"
+        self.empty_key = None
+        if self.replay is not None:
+            return self._choose_replay_search(args)
+        if self._use_album_union():
+            filter_key = json.dumps({**args, "albumIds": sorted(album["id"] for album in self.albumlist)}, sort_keys=True)
+        else:
+            if self.setting_albums:
+                self.current_album = self.albumlist[self.album_sampler.draw()]
+                args["albumIds"] = [self.current_album["id"]]
+            filter_key = json.dumps(args, sort_keys=True)
+        for attempt in range(MAX_KNOWN_EMPTY_DATE_SKIPS):
+            range_key, args["takenAfter"], args["takenBefore"] = self._get_random_time_range()
+            if not self.empty_dates.contains(filter_key, range_key):
+                break
+        self.empty_key = (filter_key, range_key)
         args["withExif"] = "true"
+        if self._use_album_union():
+            # Only search the albums that have pictures on the dates in the range
+            first = date.fromisoformat(args["takenAfter"][:10])
+            last = date.fromisoformat(args["takenBefore"][:10])
+            days = [str(first + timedelta(days=k)) for k in range((last - first).days + 1)]
+            albums = [album for album in self.albumlist if any(d in self.album_image_counts[album["id"]] for d in days)]
+        else:
+            albums = [self.current_album] if self.setting_albums else [None]
+        return self._set_chosen_range(args, albums)
+
+    def _choose_replay_search(self, args):
+        # The time range and the albums come from the recorded session instead of being chosen at random
+        self.replay_entry = self.replay.next_entry()
+        if self.replay_entry is None:
+            log(f"Replayed {len(self.replay)} dates in {time.time() - self.trace_started:.1f} seconds, "
+                f"{self.replay.mismatches} with different pictures than recorded")
+            raise ScreensaverAbortException
+        args["takenAfter"] = self.replay_entry["takenAfter"]
+        args["takenBefore"] = self.replay_entry["takenBefore"]
+        args["withExif"] = "true"
+        albums_by_id = {album["id"]: album for album in self.albumlist} if self.setting_albums else {}
+        albums = [albums_by_id.get(albumId, {"id": albumId, "albumName": ""}) for albumId in self.replay_entry["albumIds"]]
+        return self._set_chosen_range(args, albums or [None])
+
+    def _set_chosen_range(self, args, albums):
+        self.chosen_range = {
+            "takenAfter": args["takenAfter"],
+            "takenBefore": args["takenBefore"],
+            "albumIds": [album["id"] for album in albums if album is not None],
+        }
+        return args, albums
+
+    def _update_empty_dates(self, found):
+        # Remember whether the chosen range had anything to display
+        if self.empty_key is None:
+            return
+        if found:
+            self.empty_dates.discard(*self.empty_key)
+        else:
+            self.empty_dates.add(*self.empty_key)
+
+    def _search_albums(self, args, albums):
+        # All of the displayable pictures in the time range, from each album (None for the whole library)
         all_images_for_date = []
-        for page in self.immichapi.search_metadata(args):
-            for item in page:
-                if item["originalMimeType"].lower().endswith(PICTURE_FORMATS):
-                    exifinfo = item['exifInfo']
-                    image = {
-                        'localDateTime': item['localDateTime'],
-                        'id': item['id'],
-                        'originalFileName': item['originalFileName'],
-                        'originalMimeType': item['originalMimeType'],
-                        'Orientation': exifinfo['orientation']
-                    }
-                    if self.setting_tags:
-                        image['Country'] = exifinfo['country']
-                        image['State'] = exifinfo['state']
-                        image['City'] = exifinfo['city']
-                        image['Headline'] = exifinfo['description']
-                    all_images_for_date.append(image)
+        seen_ids = set()
+        if self.setting_stacks:
+            # Only the primary picture of each stack
+            args["withStacked"] = True
+        for album in albums:
+            if album is not None:
+                args["albumIds"] = [album["id"]]
+            for page in self.immichapi.search_metadata(args, page_size=SEARCH_PAGE_SIZE):
+                self._add_displayable_images(page, album, seen_ids, all_images_for_date)
         return all_images_for_date
 
+    def _get_random_time_range(self):
+        # Returns the key used to remember ranges with nothing to display, and the range to search:
+        # an event's first to last picture, or the whole of a date
+        events = self._get_event_index()
+        if events is not None and len(events) > 0:
+            taken_after, taken_before = events.next_event()
+            return taken_after, taken_after, taken_before
+        chosen_date = self._get_random_date()
+        return chosen_date, f"{chosen_date}T00:00:00.000Z", f"{chosen_date}T23:59:59.999Z"
+
+    def _use_events(self):
+        # Events need the picture times from the database, and 'On this day' is about dates
+        return self.setting_events and self.setting_dbdates and not self.setting_onthisday
+
+    def _get_event_index(self):
+        if not self._use_events():
+            return None
+        if self._use_album_union():
+            return self.album_union_events
+        if self.setting_albums:
+            return self.db_album_events[self.current_album["id"]]
+        return self.distinct_events
+
+    def _use_album_union(self):
+        # Combining albums needs the dates of every album, so it only works with dates from the database
+        return self.setting_albums and self.setting_albumunion and self.setting_dbdates
+
+    def _add_displayable_images(self, page, album, seen_ids, all_images_for_date):
+        for item in page:
+            # The same picture can be in more than one album
+            if item["id"] in seen_ids:
+                continue
+            seen_ids.add(item["id"])
+            if item["originalMimeType"].lower().endswith(PICTURE_FORMATS):
+                # The assets of a stack may come without exif info
+                exifinfo = item.get('exifInfo') or {}
+                image = {
+                    'localDateTime': item['localDateTime'],
+                    'takenMs': taken_ms(item['localDateTime']),
+                    'id': item['id'],
+                    'originalFileName': item['originalFileName'],
+                    'originalMimeType': item['originalMimeType'],
+                    'Orientation': exifinfo.get('orientation'),
+                    'thumbhash': item.get('thumbhash'),
+                    'checksum': item.get('checksum')
+                }
+                if self.setting_tags:
+                    image['Country'] = exifinfo.get('country')
+                    image['State'] = exifinfo.get('state')
+                    image['City'] = exifinfo.get('city')
+                    image['Headline'] = exifinfo.get('description')
+                if album is not None:
+                    image['albumName'] = album['albumName']
+                if self.setting_stacks and item.get('stack'):
+                    image['stackId'] = item['stack']['id']
+                    image['stackCount'] = item['stack']['assetCount']
+                all_images_for_date.append(image)
+
     def _get_random_date(self):
         if (self.setting_dbdates):
-            # Get some random date that at least one of the pictures was taken (each date is the single element of a list)
-            if (self.setting_albums):
-                # Find a date in the current album
-                album_dates = self.db_album_dates[self.current_album["id"]]
-                # Use the next date in the list of distinct dates for the selected album
-                chosen_date = album_dates["date_list"][album_dates["date_index"]]
-                # Next time choose a new date
-                album_dates["date_index"] += 1
-                if album_dates["date_index"] == len(album_dates["date_list"]):
-                    # All of the dates have been used for the album, so start over with a shuffled list of all of the dates
-                    album_dates["date_index"] = 0
-                    random.shuffle(album_dates["date_list"])
+            # Get some random date that at least one of the pictures was taken
+            if self._use_album_union():
+                # Use the next random date from all of the albums
+                chosen_date = self.album_union_dates.next_date()
+            elif (self.setting_albums):
+                # Use the next random date in the list of distinct dates for the selected album
+                chosen_date = self.db_album_dates[self.current_album["id"]].next_date()
             else:
                 # Use the next date in the list of distinct dates
-                chosen_date = self.distinct_dates[self.distinct_date_index][0]
-                # Next time choose a new date
-                self.distinct_date_index += 1
-                if self.distinct_date_index == len(self.distinct_dates):
-                    # All of the dates have been used, so start over with a shuffled list of all of the dates
-                    random.shuffle(self.distinct_dates)
-                    self.distinct_date_index = 0
+                chosen_date = self.distinct_dates.next_date()
         else:
             # Not using distinct dates from the database, so just get date from one random picture
             args={"size": 1}
@@ -401,102 +941,143 @@ class Screensaver(xbmcgui.WindowXMLDialog):
                 args.update({"isFavorite": True})
             if self.setting_albums:
                 args.update({"albumIds":  [self.current_album["id"]]})
-            response = self.immichapi.search_random(args)
-            chosen_date = response[0]['localDateTime'][:10]
-        # chosen_date = "2022-06-21"
-        # chosen_date = "2017-08-03"; self.offset_adjustment = 15 # burst
-        # chosen_date = "2001-06-02"
-        # chosen_date = "2017-06-08"
-        # chosen_date = "2013-08-01"; self.offset_adjustment = 71 # burst
-        # chosen_date = "2021-05-07" # sublocation
-        # chosen_date = "2021-04-11" # headline
-        # chosen_date = "2010-10-03" # landscape and portrait mixed
-        # chosen_date = "2025-12-17"; self.offset_adjustment = 43 # horizontal panorama
-        # chosen_date = "2025-12-16"; self.offset_adjustment = 113 # vertical panorama
-        # chosen_date = "2026-04-08"; self.offset_adjustment = 3 # cascais lighthouse
-        # chosen_date = "2023-12-13" # heic
-        # chosen_date = "2026-05-15" # heif
-        # log(f"chosen date: {chosen_date}")
+            chosen_date = self._get_on_this_day_date(args) if self.setting_onthisday else None
+            if chosen_date is None:
+                response = self.immichapi.search_random({**args, **self._get_date_range_args()})
+                if not response:
+                    # Nothing in the date range with these filters, so use any date
+                    response = self.immichapi.search_random(args)
+                chosen_date = response[0]['localDateTime'][:10]
         return chosen_date
 
+    def _get_on_this_day_date(self, args):
+        # Without the database there is no list of dates, so use the monthly timeline to find the earlier
+        # years that have pictures around today, then ask for a random picture on today's date in one of them
+        today = date.today()
+        years = [
+            year for year in self._get_on_this_day_years(args, today)
+            if self.date_range.contains(f"{year:04d}-{today.month:02d}-{today.day:02d}")
+        ]
+        if not years:
+            return None
+        year = random.choice(years)
+        try:
+            day = date(year, today.month, today.day)
+        except ValueError:
+            # February 29 in a year that isn't a leap year
+            day = date(year, 2, 28)
+        # First try the day itself, then the days around it
+        for window in (0, ON_THIS_DAY_MAX_WINDOW_DAYS):
+            window_args = dict(args)
+            window_args["takenAfter"] = f"{day - timedelta(days=window)}T00:00:00.000Z"
+            window_args["takenBefore"] = f"{day + timedelta(days=window)}T23:59:59.999Z"
+            response = self.immichapi.search_random(window_args)
+            if response:
+                return response[0]['localDateTime'][:10]
+        return None
+
+    def _get_on_this_day_years(self, args, today):
+        # Years before this one with pictures in the months around today, for these search filters
+        key = (json.dumps(args, sort_keys=True), today)
+        if key not in self.on_this_day_years:
+            months = {month for month, day in month_days_around(today, ON_THIS_DAY_MAX_WINDOW_DAYS)}
+            years = set()
+            for bucket in self.immichapi.get_timeline_buckets(self._get_bucket_args()):
+                year, month = int(bucket["timeBucket"][:4]), int(bucket["timeBucket"][5:7])
+                if month in months and year < today.year and bucket.get("count", 1) > 0:
+                    years.add(year)
+            self.on_this_day_years[key] = sorted(years)
+        return self.on_this_day_years[key]
+
+    def _get_date_range_args(self):
+        # The search filters for the date range, when dates come from random pictures
+        if not self.date_range.is_limited():
+            return {}
+        first = self.date_range.first or self._get_oldest_date()
+        last = self.date_range.last or date.today().isoformat()
+        if self.date_range.recency > 0 and first is not None:
+            # Choose after a cutoff, the same way as for dates from the database
+            cutoff = self.date_range.draw_cutoff(date.fromisoformat(first).toordinal(), date.fromisoformat(last).toordinal())
+            first = date.fromordinal(cutoff).isoformat()
+        args = {"takenBefore": f"{last}T23:59:59.999Z"}
+        if first is not None:
+            args["takenAfter"] = f"{first}T00:00:00.000Z"
+        return args
+
+    def _get_oldest_date(self):
+        # The first day of the oldest month with pictures for the current filters, from the monthly timeline
+        key = json.dumps(self._get_bucket_args(), sort_keys=True)
+        if key not in self.oldest_dates:
+            buckets = [bucket["timeBucket"] for bucket in self.immichapi.get_timeline_buckets(self._get_bucket_args())]
+            self.oldest_dates[key] = min(buckets)[:10] if buckets else None
+        return self.oldest_dates[key]
+
+    def _get_bucket_args(self):
+        # The timeline uses its own names for the search filters
+        bucket_args = {}
+        if self.setting_favsOnly:
+            bucket_args["isFavorite"] = "true"
+        if self.setting_albums:
+            bucket_args["albumId"] = self.current_album["id"]
+        return bucket_args
+
     def _group_images(self, all_images_for_date):
         # Sort by time, break ties with filename - pictures taken same second are ordered correctly
-        all_images_for_date.sort(key=lambda x: (x["localDateTime"], x["originalFileName"]))
-        group_index = 0
-        # Put the first picture in the first group
-        image_groupings=[[all_images_for_date[0]]]
-        # Get date and time with milliseconds, but without time zone
-        prev_image_date_object = datetime.fromisoformat(all_images_for_date[0]['localDateTime'].rstrip("Z"))
-        # Go through the rest of the images
-        image_index = 1
-        while image_index < len(all_images_for_date):
-            # Get date and time with milliseconds, but without time zone
-            this_image_date_object = datetime.fromisoformat(all_images_for_date[image_index]['localDateTime'].rstrip("Z"))
-            # Calculate difference between when this picture was taken and when the last picture was taken
-            datediff = this_image_date_object - prev_image_date_object
-            if datediff.total_seconds() <= 2:
-                # image within two seconds of previous image go in same group
-                image_groupings[group_index].append(all_images_for_date[image_index])
-                if not self.setting_burst:
-                    # Only store the first and last images if not showing them in burst mode
-                    if len(image_groupings[group_index]) > 2:
-                        image_groupings[group_index].pop(1)
-            else:
-                group_index += 1
-                image_groupings.append([all_images_for_date[image_index]])
-            prev_image_date_object = this_image_date_object
-            image_index+=1
-        return image_groupings
-    
+        all_images_for_date.sort(key=lambda x: (x["takenMs"], x["originalFileName"]))
+        return [
+            self._make_group(all_images_for_date[start:end])
+            for start, end in burst_ranges([image["takenMs"] for image in all_images_for_date], self.burst_gap_ms)
+        ]
+
+    def _make_group(self, image_group):
+        if self.setting_burst or len(image_group) <= 2:
+            return image_group
+        # Only keep the first and last images if not showing them in burst mode
+        return [image_group[0], image_group[-1]]
+
     def _get_local_filename_for_image(self, image):
         # We store the downloaded images in the addon's userdata folder
         return str(ADDON_USERDATA_FOLDER / (image['id'] + IMMICH_TEMP_FILE_EXTENSION))
 
+    def _show_placeholder(self, image, control_index):
+        # A temporary file too, so it is deleted with the pictures
+        filename = str(ADDON_USERDATA_FOLDER / (image['id'] + '-placeholder' + IMMICH_TEMP_FILE_EXTENSION))
+        try:
+            if not write_png(image.get('thumbhash'), filename):
+                return
+        except OSError:
+            return
+        self.background_controls[control_index].setImage(filename, False)
+        self._set_prop('Background', str(control_index))
+        self._set_prop('Splash', 'hide')
+
     def _get_image_info(self, image):
         info = {}
         iptc_info = {}
         # Get extra info for this image
         if self.setting_date:
-            imgdatetime = image['localDateTime'][:18]
-            info['Date'] = time.strftime('%A %B %e, %Y',time.strptime(imgdatetime, '%Y-%m-%dT%H:%M:%S'))
-            info['Time'] = time.strftime('%I:%M %p',time.strptime(imgdatetime, '%Y-%m-%dT%H:%M:%S'))
+            imgdatetime = time.strptime(image['localDateTime'][:18], '%Y-%m-%dT%H:%M:%S')
+            info['Date'] = time.strftime('%A %B %e, %Y',imgdatetime)
+            info['Time'] = time.strftime('%I:%M %p',imgdatetime)
         if self.setting_albums and self.setting_albumname:
-            info['AlbumName'] = self.current_album['albumName']
+            info['AlbumName'] = image['albumName']
         if self.setting_tags:
             # Get more info from the actual file.
-            iptc_info = self._get_iptcinfo(self._get_local_filename_for_image(image))
+            if image.get('iptc') is None:
+                image['iptc'] = read_iptc(self._get_local_filename_for_image(image))
+            iptc_info = image['iptc']
         image_info = {**info, **iptc_info}
         return image_info
 
-    def _get_iptcinfo(self, filename):
-        fields = {
-            "Headline": "headline",
-            "Caption": "caption/abstract",
-            "Sublocation": "sub-location",
-            "City": "city",
-            "State": "province/state",
-            "Country": "country/primary location name",
-        }
-        iptcinfo = {}
-        try:
-            iptc = IPTCInfo(filename)
-            for key, tag in fields.items():
-                if not iptc[tag]:
-                    continue
-                raw = bytes(iptc[tag])
-                try:
-                    iptcinfo[key] = raw.decode("utf-8")
-                except UnicodeDecodeError:
-                    iptcinfo[key] = raw.decode("latin-1", errors="replace")
-            return iptcinfo
-        except Exception:
-            return iptcinfo
+    def _get_info_fields(self, image):
+        # The value of each info label, None for the labels to clear
+        return {prop: image.get(prop) for prop in ('AlbumName', 'Headline', 'Caption', 'Sublocation', 'City', 'State', 'Country', 'Date', 'Time')}
 
-    def _set_info_fields(self, image, order):
+    def _set_info_fields(self, info, order):
         # Assign whatever info was found into the correct labels
-        for prop in ('AlbumName', 'Headline', 'Caption', 'Sublocation', 'City', 'State', 'Country', 'Date', 'Time'):
-            if prop in image:
-                self._set_prop(prop+str(order),image[prop])
+        for prop, value in info.items():
+            if value is not None:
+                self._set_prop(prop+str(order),value)
             else: 
                 self._clear_prop(prop+str(order))
 
@@ -515,9 +1096,11 @@ class Screensaver(xbmcgui.WindowXMLDialog):
             else:
                 return slideshow_ms,[FADEOUT_EFFECT]
 
-        screen_w = self.winid.getWidth()
-        screen_h = self.winid.getHeight()
-        img_w, img_h = imagesize.get(image['local_path'])
+        screen_w = self.screen_w
+        screen_h = self.screen_h
+        if not image.get('size'):
+            image['size'] = list(imagesize.get(image['local_path']))
+        img_w, img_h = image['size']
         aspect_ratio = max(img_w, img_h) / min(img_w, img_h)
         PANORAMA_RATIO = 1.85
         if (self.setting_panorama and aspect_ratio >= PANORAMA_RATIO):
@@ -543,8 +1126,8 @@ class Screensaver(xbmcgui.WindowXMLDialog):
                 base_scale = 115 + self.setting_time
                 scale_h = screen_h * (base_scale / 100.0)
                 scale_w = screen_w * (base_scale / 100.0)
-                slide_x = random.randint(-1,1) * ((scale_w - screen_w) / 2.0)
-                slide_y = random.randint(-1,1) * ((scale_h - screen_h) / 2.0)
+                slide_x = self.animation_rng.randint(-1,1) * ((scale_w - screen_w) / 2.0)
+                slide_y = self.animation_rng.randint(-1,1) * ((scale_h - screen_h) / 2.0)
                 scale_start = base_scale if (slide_x,slide_y) != (0,0) else 100 
                 scale_end = base_scale * 1.2 if (slide_x,slide_y) != (0,0) else base_scale * 1.3
             else: # Just crossfade
@@ -581,6 +1164,15 @@ class Screensaver(xbmcgui.WindowXMLDialog):
         # exit when onScreensaverDeactivated gets called
         self.close()
 
+class Slide():
+    # A picture ready to show: its file, its info labels and its animation
+    def __init__(self, path, transition, info, duration, animation):
+        self.path = path
+        self.transition = transition
+        self.info = info
+        self.duration = duration
+        self.animation = animation
+
 class ScreensaverAbortException(Exception):
     # Used to end the screensaver when a key is pressed
     pass
@@ -1,7 +1,25 @@
-# Only expose ImmichAPI and log/notify by default, otherwise everone needs stuff im modules directory
+# Everything the screensaver and the service use from this package. DatabaseAPI is left out, since it needs
+# the modules directory on the path.
 from .helpers import log
 from .helpers import notify
+from .helpers import set_home_prop, get_home_prop
 from .immichapi import ImmichAPI
+from .datecache import DateCache
+from .dateindex import DateIndex, DateRotations, WeightedDates
+from .emptydates import EmptyDates
+from .sampling import AliasSampler
+from .onthisday import OnThisDay, month_days_around
+from .eventindex import EventIndex, merge_events
+from .daterange import DateRange, RecentDates
+from .sessiontrace import SessionRecorder, SessionReplay
+from .grouping import burst_ranges, iter_bursts, taken_ms, BURST_GAP_MS
+from .pageloader import PageLoader
+from .thumbhash import NearDuplicates, write_png
+from .iptc import read_iptc
+from .headers import HeaderParser
+from .metadatacache import MetadataCache
+from .datecache import ALL_SCOPE, FAVORITES_SCOPE, SERVICE_REFRESHED_PROPERTY, album_scope
+from .datecache import IMAGES, FAVORITE_IMAGES
 
 # DatabaseAPI is optional — import only when requested
 def __getattr__(name):
@@ -1,8 +1,45 @@
 import pg8000.dbapi # For postgressql database access
+from pg8000.core import PASSWORD, _flush, i_unpack
+from scramp.core import ClientStage, _make_salted_password, _c_key_stored_key_s_key, _make_cbind_input, _make_auth_message
+from scramp.utils import b64dec, b64enc, h, hmac, uenc, xor
+import json
+import os
+import socket
+import struct
+import tempfile
+import threading
+from datetime import date
+from .helpers import log
+
+# Sent on a new connection to ask the server to cancel the query running on another connection
+CANCEL_REQUEST_CODE = 80877102
+# How often the watcher thread checks whether the screensaver is stopping
+ABORT_POLL_SECONDS = 0.05
+# Authentication request code for the server's SCRAM challenge (salt and iteration count)
+AUTHENTICATION_SASL_CONTINUE = 11
+# Number of servers/users to keep SCRAM keys for
+MAX_SCRAM_KEYS = 4
+
+# Binary COPY format: signature, flags and header extension length, then one tuple per row, then -1
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+COPY_HEADER = struct.Struct("!11sii")
+COPY_TRAILER = b"\xff\xff"
+# Dates in the binary format are days since 2000-01-01
+POSTGRES_EPOCH_ORDINAL = date(2000, 1, 1).toordinal()
+# Fixed width column types that the COPY parser understands: struct code and width
+COPY_COLUMN_TYPES = {
+    "date": ("i", 4),
+    "int4": ("i", 4),
+    "int8": ("q", 8),
+    "bool": ("?", 1),
+    # Left as microseconds since 2000-01-01 UTC
+    "timestamptz": ("q", 8),
+}
 
 class DatabaseAPI():
-    def __init__(self, dbname, dbuser, dbpassword, dbhost, dbport, abort_exception, abort_function):
-        self.DB = pg8000.dbapi.Connection(
+    def __init__(self, dbname, dbuser, dbpassword, dbhost, dbport, abort_exception, abort_function, key_cache_file=None):
+        self.DB = _Connection(
+            ScramKeyCache(key_cache_file) if key_cache_file else None,
             database=dbname,
             user=dbuser,
             password=dbpassword,
@@ -12,26 +49,14 @@ class DatabaseAPI():
         )
         self.abort_function = abort_function
         self.abort_exception = abort_exception
-
-    def exec_query(self,query):
-        cursor = self.DB.cursor() 
-        cursor.execute("SET statement_timeout = '1000ms'")
-        cursor.execute(query)
-        records = []
-        while True:
-            if self.abort_function ():
-                raise self.abort_exception()
-            rows = cursor.fetchmany(100)
-            if not rows:
-                break
-            records.extend(rows)
-        return records
+        self.dbhost = dbhost
+        self.dbport = dbport
 
     def exec_query(self, query):
         cursor = self.DB.cursor()
         try:
             cursor.execute("SET statement_timeout = '1000ms'")
-            cursor.execute(query)
+            self._execute(cursor, query)
             records = []
             while True:
                 if self.abort_function():
@@ -47,8 +72,174 @@ class DatabaseAPI():
             except:
                 pass
 
+    def copy_query(self, query, column_types):
+        # Much faster than exec_query for large results: the rows are streamed into a local file with the
+        # binary COPY protocol, so pg8000 doesn't decode each value from text. Only fixed width, non-null
+        # columns of the types in COPY_COLUMN_TYPES are supported.
+        cursor = self.DB.cursor()
+        try:
+            cursor.execute("SET statement_timeout = '1000ms'")
+            with tempfile.TemporaryFile() as f:
+                stream = _AbortableStream(f, self.abort_function, self.abort_exception)
+                self._execute(cursor, f"COPY ({query.strip().rstrip(';')}) TO STDOUT WITH (FORMAT binary)", stream)
+                f.seek(0)
+                return _parse_binary_copy(f.read(), column_types)
+        finally:
+            try:
+                cursor.close()
+            except:
+                pass
+
+    def _execute(self, cursor, query, stream=None):
+        # While the query runs, a watcher thread cancels it on the server as soon as the
+        # screensaver is asked to stop, instead of waiting for the statement_timeout
+        done = threading.Event()
+        watcher = threading.Thread(target=self._cancel_on_abort, args=(done,), daemon=True)
+        watcher.start()
+        try:
+            cursor.execute(query, stream=stream)
+        except self.abort_exception:
+            raise
+        except Exception:
+            if self.abort_function():
+                # The query failed because we cancelled it
+                raise self.abort_exception()
+            raise
+        finally:
+            done.set()
+            watcher.join()
+
+    def _cancel_on_abort(self, done):
+        while not done.wait(ABORT_POLL_SECONDS):
+            if self.abort_function():
+                self._send_cancel_request()
+                return
+
+    def _send_cancel_request(self):
+        # The backend key data (process id and secret key) was sent by the server at connection startup
+        key_data = self.DB._backend_key_data
+        if key_data is None:
+            return
+        try:
+            with socket.create_connection((self.dbhost, self.dbport), timeout=1) as sock:
+                sock.sendall(struct.pack("!ii", 8 + len(key_data), CANCEL_REQUEST_CODE) + key_data)
+        except OSError as e:
+            log(f"Failed to cancel database query: {e}")
+
     def close(self):
         try:
             self.DB.close()
         except:
             pass
+
+class _Connection(pg8000.dbapi.Connection):
+    # pg8000's connection, except that SCRAM authentication reuses the keys derived for an earlier connection
+    def __init__(self, key_cache, **kwargs):
+        self.key_cache = key_cache
+        super().__init__(**kwargs)
+
+    def handle_AUTHENTICATION_REQUEST(self, data, context):
+        if self.key_cache is None or i_unpack(data)[0] != AUTHENTICATION_SASL_CONTINUE:
+            return super().handle_AUTHENTICATION_REQUEST(data, context)
+        self.auth.set_server_first(data[4:].decode("utf8"))
+        # SASLResponse
+        msg = self.key_cache.get_client_final(self.auth).encode("utf8")
+        self._send_message(PASSWORD, msg)
+        _flush(self._sock)
+
+class ScramKeyCache():
+    # Deriving the salted password (PBKDF2 with the server's iteration count) is slow on small devices,
+    # so the ClientKey and ServerKey derived from it are kept for as long as the server's salt and
+    # iteration count don't change. The keys let anyone log in as the user, so the file is only
+    # readable by its owner.
+    def __init__(self, filename):
+        self.filename = str(filename)
+        self.keys = {}
+        try:
+            with open(self.filename, "r", encoding="utf-8") as f:
+                self.keys = json.load(f)
+        except Exception:
+            self.keys = {}
+
+    def get_client_final(self, client):
+        # Same as ScramClient.get_client_final, but with cached keys
+        client._set_stage(ClientStage.get_client_final)
+        client_key, server_key = self._get_keys(client)
+        stored_key = h(client.hf, client_key)
+        cbind_input = _make_cbind_input(client.channel_binding, client.use_binding)
+        client_final_without_proof = f"c={b64enc(cbind_input)},r={client.nonce}"
+        auth_msg = _make_auth_message(client.client_first_bare, client.server_first, client_final_without_proof)
+        client_signature = hmac(client.hf, stored_key, auth_msg)
+        client_proof = xor(client_key, client_signature)
+        client.server_signature = b64enc(hmac(client.hf, server_key, auth_msg))
+        return f"{client_final_without_proof},p={b64enc(client_proof)}"
+
+    def _get_keys(self, client):
+        key = "|".join((client.mechanism_name, client.salt, str(client.iterations), client.username))
+        entry = self.keys.get(key)
+        if entry is not None:
+            client_key, server_key = b64dec(entry["client_key"]), b64dec(entry["server_key"])
+            # Make sure the keys were made from the password we have now. This check
+            # is only cheap for someone who already has the keys.
+            if entry["check"] == b64enc(hmac(client.hf, client_key, uenc(client.password))):
+                return client_key, server_key
+        salted_password = _make_salted_password(client.hf, client.password, b64dec(client.salt), client.iterations)
+        client_key, stored_key, server_key = _c_key_stored_key_s_key(client.hf, salted_password)
+        self.keys.pop(key, None)
+        self.keys[key] = {
+            "client_key": b64enc(client_key),
+            "server_key": b64enc(server_key),
+            "check": b64enc(hmac(client.hf, client_key, uenc(client.password))),
+        }
+        while len(self.keys) > MAX_SCRAM_KEYS:
+            del self.keys[next(iter(self.keys))]
+        self._save()
+        return client_key, server_key
+
+    def _save(self):
+        tmp_filename = self.filename + ".tmp"
+        try:
+            fd = os.open(tmp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.keys, f)
+            os.replace(tmp_filename, self.filename)
+        except Exception as e:
+            log(f"Failed to save database keys: {type(e).__name__} {str(e)}")
+
+class _AbortableStream():
+    # Lets the user stop the screensaver while COPY data is still arriving
+    def __init__(self, f, abort_function, abort_exception):
+        self.f = f
+        self.abort_function = abort_function
+        self.abort_exception = abort_exception
+
+    def write(self, data):
+        if self.abort_function():
+            raise self.abort_exception()
+        return self.f.write(data)
+
+def _parse_binary_copy(data, column_types):
+    signature, flags, extension_length = COPY_HEADER.unpack_from(data)
+    if signature != COPY_SIGNATURE:
+        raise ValueError("Not a binary COPY stream")
+    start = COPY_HEADER.size + extension_length
+    end = len(data) - len(COPY_TRAILER)
+    if data[end:] != COPY_TRAILER:
+        raise ValueError("Binary COPY stream is truncated")
+    # Every row has the same layout: field count, then a length and a value for each column
+    row_format = "!h" + "".join("i" + COPY_COLUMN_TYPES[t][0] for t in column_types)
+    row_struct = struct.Struct(row_format)
+    if (end - start) % row_struct.size != 0:
+        raise ValueError("Binary COPY stream has unexpected row sizes (null values?)")
+    layout = (len(column_types),) + tuple(COPY_COLUMN_TYPES[t][1] for t in column_types)
+    date_columns = [i for i, t in enumerate(column_types) if t == "date"]
+    rows = []
+    for values in row_struct.iter_unpack(memoryview(data)[start:end]):
+        if values[0:1] + values[1::2] != layout:
+            raise ValueError("Binary COPY stream has unexpected row layout (null values?)")
+        # Skip the field count and the lengths
+        row = list(values[2::2])
+        for i in date_columns:
+            row[i] = date.fromordinal(row[i] + POSTGRES_EPOCH_ORDINAL)
+        rows.append(tuple(row))
+    return rows
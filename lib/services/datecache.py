@@ -0,0 +1,293 @@
+import bisect
+import json
+import os
+from datetime import date, datetime
+from .helpers import log
+
+# Bump whenever the layout of the cache file changes, so old caches are rebuilt
+SCHEMA_VERSION = 2
+# If more dates than this fraction of the index changed since the last refresh, rebuild from scratch
+MAX_DELTA_FRACTION = 0.25
+
+# Home window property set by the background service each time it has refreshed the cache file
+SERVICE_REFRESHED_PROPERTY = "DateCacheRefreshed"
+
+# Each date in a scope has these counts: all assets, images, and favorite images
+ASSETS = 0
+IMAGES = 1
+FAVORITE_IMAGES = 2
+# The SQL for those counts, in the same order
+COUNTS_SQL = """COUNT(*), COUNT(*) FILTER (WHERE a."type" = 'IMAGE'), COUNT(*) FILTER (WHERE a."type" = 'IMAGE' AND a."isFavorite" = TRUE)"""
+
+# Event times are microseconds since 2000-01-01 UTC, as they come from the database
+EPOCH_2000 = date(2000, 1, 1).toordinal()
+ONE_DAY_US = 24 * 60 * 60 * 1000000
+
+ALL_SCOPE = "all"
+FAVORITES_SCOPE = "favorites"
+
+def album_scope(albumId):
+    return f"album:{albumId}"
+
+class DateCache():
+    # Keeps the number of assets and images taken on each date, for each scope (all, favorites, or one album).
+    # Each scope also remembers the newest "updatedAt" seen, so later refreshes only
+    # have to look at the assets that changed since then.
+    def __init__(self, filename, source):
+        self.filename = str(filename)
+        self.source = source
+        self.scopes = {}
+        self.changed = False
+        self._load()
+
+    def get(self, scope):
+        # The cached dates for the scope, without checking the database. None if the scope was never loaded
+        entry = self.scopes.get(scope)
+        return entry["counts"] if entry is not None else None
+
+    def get_events(self, scope, gap_seconds, favorites_only, databaseAPI=None):
+        # The events of the scope's pictures (see EventIndex), as {"starts", "ends", "counts"}.
+        # They are kept with the scope's dates, and refresh() only works out again the events around
+        # the dates that changed. Without a database connection, None if they aren't cached.
+        entry = self.scopes.get(scope)
+        if entry is None:
+            return None
+        key = _events_key(gap_seconds, favorites_only)
+        events = entry.setdefault("events", {})
+        if key not in events:
+            if databaseAPI is None:
+                return None
+            events[key] = self._get_events(scope, gap_seconds, favorites_only, databaseAPI)
+            self.changed = True
+        return events[key]
+
+    def _load(self):
+        self.scopes = self._read()
+
+    def _read(self):
+        # The scopes in the file, or nothing if it is missing, old or for another database
+        try:
+            with open(self.filename, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == SCHEMA_VERSION and data.get("source") == self.source:
+                return data.get("scopes", {})
+        except Exception:
+            pass
+        return {}
+
+    def _merge(self, saved):
+        # The service and the screensaver each keep a copy of the cache, and save it to the same file.
+        # Of each scope the newer copy is kept, so neither undoes the other's refreshes; if both are
+        # in the same state, the events worked out by either are kept.
+        for scope, theirs in saved.items():
+            ours = self.scopes.get(scope)
+            if ours is None or _state(theirs) > _state(ours):
+                self.scopes[scope] = theirs
+            elif _state(theirs) == _state(ours) and ours["total"] == theirs["total"]:
+                events = ours.setdefault("events", {})
+                for key, value in theirs.get("events", {}).items():
+                    events.setdefault(key, value)
+
+    def save(self):
+        if not self.changed:
+            return
+        self._merge(self._read())
+        data = {"version": SCHEMA_VERSION, "source": self.source, "scopes": self.scopes}
+        tmp_filename = self.filename + ".tmp"
+        try:
+            with open(tmp_filename, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp_filename, self.filename)
+            self.changed = False
+        except Exception as e:
+            log(f"Failed to save date cache: {type(e).__name__} {str(e)}")
+
+    def refresh(self, scope, databaseAPI):
+        # Bring the dates for the scope up to date, and return them as {"YYYY-MM-DD": [assets, images, favorite images]}
+        table, where = _scope_sql(scope)
+        # Get the watermark first, so changes made while we are querying are seen next time
+        query = f"""
+            SELECT MAX(a."updatedAt"), COUNT(*) FILTER (WHERE a."deletedAt" IS NULL){_album_updated_sql(scope)}
+            FROM {table}
+            WHERE {where};
+        """
+        row = databaseAPI.exec_query(query)[0]
+        watermark = row[0].isoformat() if row[0] is not None else None
+        total = row[1]
+        album_updated = row[2].isoformat() if len(row) > 2 and row[2] is not None else None
+        entry = self.scopes.get(scope)
+        delta = None
+        if entry is not None:
+            if entry["watermark"] == watermark and entry["total"] == total and entry.get("album_updated") == album_updated:
+                # Nothing changed since last time
+                return entry["counts"]
+            if entry.get("album_updated") == album_updated:
+                delta = self._apply_delta(scope, entry, total, databaseAPI)
+        new_entry = {"watermark": watermark, "total": total, "album_updated": album_updated}
+        if delta is None:
+            # Events are worked out again for the whole scope when they are next asked for
+            new_entry["counts"] = self._rebuild(scope, databaseAPI)
+        else:
+            new_entry["counts"], changed_dates = delta
+            new_entry["events"] = {
+                key: self._update_events(scope, key, events, changed_dates, databaseAPI)
+                for key, events in entry.get("events", {}).items()
+            }
+        self.scopes[scope] = new_entry
+        self.changed = True
+        return new_entry["counts"]
+
+    def _apply_delta(self, scope, entry, total, databaseAPI):
+        # Recount only the dates that had assets added, changed or moved to the trash. Returns the counts
+        # and the changed dates, or None if the result does not add up, in which case the caller rebuilds
+        # the whole scope.
+        if entry["watermark"] is None:
+            return None
+        table, where = _scope_sql(scope)
+        query = f"""
+            SELECT DISTINCT DATE(a."fileCreatedAt")
+            FROM {table}
+            WHERE {where} AND a."updatedAt" > '{entry["watermark"]}';
+        """
+        changed_dates = [str(d) for (d,) in databaseAPI.exec_query(query)]
+        counts = dict(entry["counts"])
+        if len(changed_dates) > max(len(counts) * MAX_DELTA_FRACTION, 1):
+            log(f"Date cache for {scope}: {len(changed_dates)} changed dates, rebuilding")
+            return None
+        if changed_dates:
+            date_list = ", ".join(f"'{d}'" for d in changed_dates)
+            query = f"""
+                SELECT DATE(a."fileCreatedAt"), {COUNTS_SQL}
+                FROM {table}
+                WHERE {where} AND a."deletedAt" IS NULL AND DATE(a."fileCreatedAt") IN ({date_list})
+                GROUP BY 1;
+            """
+            recounted = {str(d): list(c) for (d, *c) in databaseAPI.exec_query(query)}
+            for d in changed_dates:
+                if d in recounted:
+                    counts[d] = recounted[d]
+                else:
+                    counts.pop(d, None)
+        if sum(c[ASSETS] for c in counts.values()) != total:
+            # Assets were moved to other dates or deleted permanently; the delta can't account for that
+            log(f"Date cache for {scope}: counts do not match total after delta, rebuilding")
+            return None
+        log(f"Date cache for {scope}: merged {len(changed_dates)} changed dates")
+        return counts, changed_dates
+
+    def _rebuild(self, scope, databaseAPI):
+        # A full rebuild can return many thousands of rows, so use the bulk COPY path
+        table, where = _scope_sql(scope)
+        query = f"""
+            SELECT DATE(a."fileCreatedAt"), {COUNTS_SQL}
+            FROM {table}
+            WHERE {where} AND a."deletedAt" IS NULL
+            GROUP BY 1
+        """
+        return {str(d): list(c) for (d, *c) in databaseAPI.copy_query(query, ("date", "int8", "int8", "int8"))}
+
+    def _update_events(self, scope, key, events, changed_dates, databaseAPI):
+        # Work out again only the events around the changed dates, and splice them in. Events are more
+        # than the gap apart, so once a time range is widened to whole events at both ends, the events
+        # in it don't depend on any picture outside it.
+        if not changed_dates:
+            return events
+        gap_seconds, favorites_only = _parse_events_key(key)
+        gap_us = gap_seconds * 1000000
+        starts = events["starts"]
+        ends = events["ends"]
+        ranges = []
+        for d in sorted(changed_dates):
+            # A day either side, since the database's dates may not be UTC days
+            first = (date.fromisoformat(d).toordinal() - EPOCH_2000 - 1) * ONE_DAY_US - gap_us
+            last = first + 3 * ONE_DAY_US + 2 * gap_us
+            # Widen to the events the ends fall in
+            i = bisect.bisect_right(starts, first) - 1
+            if i >= 0 and ends[i] >= first:
+                first = starts[i]
+            i = bisect.bisect_right(starts, last) - 1
+            if i >= 0 and ends[i] >= last:
+                last = ends[i]
+            if ranges and first <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], last)
+            else:
+                ranges.append([first, last])
+        kept = [
+            (starts[i], ends[i], events["counts"][i]) for i in range(len(starts))
+            if not any(first <= starts[i] and ends[i] <= last for first, last in ranges)
+        ]
+        updated = []
+        for first, last in ranges:
+            updated.extend(self._query_events(scope, gap_seconds, favorites_only, databaseAPI, (first, last)))
+        rows = sorted(kept + updated)
+        log(f"Date cache for {scope}: {len(updated)} events updated around {len(changed_dates)} changed dates")
+        return _events_lists(rows)
+
+    def _get_events(self, scope, gap_seconds, favorites_only, databaseAPI):
+        rows = self._query_events(scope, gap_seconds, favorites_only, databaseAPI)
+        log(f"Date cache for {scope}: {len(rows)} events")
+        return _events_lists(rows)
+
+    def _query_events(self, scope, gap_seconds, favorites_only, databaseAPI, time_range=None):
+        # A picture starts a new event when it was taken more than the gap after the one before it.
+        # Numbering the events with a running count of those starts lets the database do the
+        # clustering in one pass over the index, and only send back one row per event.
+        # time_range limits the pictures to (first, last), in microseconds since 2000.
+        table, where = _scope_sql(scope)
+        favorites = ' AND a."isFavorite" = TRUE' if favorites_only else ""
+        if time_range is not None:
+            favorites += f' AND a."fileCreatedAt" BETWEEN {_timestamp_sql(time_range[0])} AND {_timestamp_sql(time_range[1])}'
+        query = f"""
+            SELECT MIN(t), MAX(t), COUNT(*)
+            FROM (
+                SELECT t, SUM(CASE WHEN t - previous > INTERVAL '{int(gap_seconds)} seconds' THEN 1 ELSE 0 END) OVER (ORDER BY t) AS event
+                FROM (
+                    SELECT a."fileCreatedAt" AS t, LAG(a."fileCreatedAt") OVER (ORDER BY a."fileCreatedAt") AS previous
+                    FROM {table}
+                    WHERE {where} AND a."deletedAt" IS NULL AND a."type" = 'IMAGE'{favorites}
+                ) pictures
+            ) numbered
+            GROUP BY event
+        """
+        return [tuple(r) for r in databaseAPI.copy_query(query, ("timestamptz", "timestamptz", "int8"))]
+
+def _state(entry):
+    # How up to date a scope is, to compare copies of it. Copies without a watermark come first.
+    return tuple(
+        (value is not None, datetime.fromisoformat(value) if value is not None else None)
+        for value in (entry["watermark"], entry.get("album_updated"))
+    )
+
+def _events_lists(rows):
+    return {
+        "starts": [r[0] for r in rows],
+        "ends": [r[1] for r in rows],
+        "counts": [r[2] for r in rows],
+    }
+
+def _events_key(gap_seconds, favorites_only):
+    return f"{gap_seconds}:{'favorites' if favorites_only else 'images'}"
+
+def _parse_events_key(key):
+    gap_seconds, pictures = key.split(":")
+    return int(gap_seconds), pictures == "favorites"
+
+def _timestamp_sql(microseconds):
+    return f"(TIMESTAMPTZ '2000-01-01 00:00:00+00' + {int(microseconds)} * INTERVAL '1 microsecond')"
+
+def _scope_sql(scope):
+    # The table expression and the filter for the assets in a scope. Trashed assets are included,
+    # so moving an asset to the trash shows up as a change.
+    if scope == ALL_SCOPE:
+        return "asset a", "TRUE"
+    if scope == FAVORITES_SCOPE:
+        return "asset a", 'a."isFavorite" = TRUE'
+    albumId = scope.split(":", 1)[1]
+    return 'album_asset aa JOIN asset a ON a."id" = aa."assetId"', f"""aa."albumId" = '{albumId}'"""
+
+def _album_updated_sql(scope):
+    # Album membership changes don't touch the assets, so watch the album itself too
+    if not scope.startswith("album:"):
+        return ""
+    albumId = scope.split(":", 1)[1]
+    return f""", (SELECT "updatedAt" FROM album WHERE "id" = '{albumId}')"""
@@ -0,0 +1,118 @@
+import base64
+import bisect
+import json
+import os
+import random
+import sys
+from array import array
+from datetime import date
+from .helpers import log
+
+class DateIndex():
+    # The dates of a scope, kept compactly as day ordinals (4 bytes each instead of a tuple and a date object).
+    # Dates are handed out in random order by shuffling lazily: each call to next_date() does one step
+    # of a Fisher-Yates shuffle, so there is no up front cost, and once every date has been used the
+    # next pass over the same array is a new random order.
+    # The array and the cursor are the whole state of the shuffle, so passing back a saved state
+    # continues the same pass: everything before the cursor has been shown, everything after it hasn't.
+    def __init__(self, dates, rng=None, state=None):
+        self.ordinals = array('I', (date.fromisoformat(str(d)).toordinal() for d in dates))
+        self.cursor = 0
+        self.rng = rng if rng is not None else random
+        if state is not None:
+            self._restore(state)
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def next_date(self):
+        # Returns the next date as "YYYY-MM-DD"
+        ordinals = self.ordinals
+        if self.cursor >= len(ordinals):
+            # All of the dates have been used, so start over
+            self.cursor = 0
+        j = self.rng.randrange(self.cursor, len(ordinals))
+        ordinals[self.cursor], ordinals[j] = ordinals[j], ordinals[self.cursor]
+        chosen = ordinals[self.cursor]
+        self.cursor += 1
+        return date.fromordinal(chosen).isoformat()
+
+    def get_state(self):
+        saved = array('I', self.ordinals)
+        if sys.byteorder == "big":
+            saved.byteswap()
+        return {"ordinals": base64.b64encode(saved.tobytes()).decode("ascii"), "cursor": self.cursor}
+
+    def _restore(self, state):
+        saved = array('I')
+        saved.frombytes(base64.b64decode(state["ordinals"]))
+        if sys.byteorder == "big":
+            saved.byteswap()
+        cursor = min(state["cursor"], len(saved))
+        current = set(self.ordinals)
+        # Dates removed from the index are dropped, and dates added since are not shown yet
+        shown = [o for o in saved[:cursor] if o in current]
+        not_shown = [o for o in saved[cursor:] if o in current]
+        known = set(saved)
+        added = [o for o in self.ordinals if o not in known]
+        self.ordinals = array('I', shown + not_shown + added)
+        self.cursor = len(shown)
+
+class WeightedDates():
+    # Picks dates at random, with replacement, weighted by the number of pictures on each date.
+    # blend 0 makes every date equally likely, blend 1 makes the chance proportional to the count.
+    # Each pick is a bisect into the cumulative weights, so it costs O(log n).
+    def __init__(self, counts, blend, rng=None):
+        dates = sorted(counts)
+        self.ordinals = array('I', (date.fromisoformat(d).toordinal() for d in dates))
+        self.cumulative = array('d')
+        self.rng = rng if rng is not None else random
+        total_count = sum(counts.values()) or 1
+        running = 0.0
+        for d in dates:
+            running += ((1.0 - blend) / len(dates)) + (blend * counts[d] / total_count)
+            self.cumulative.append(running)
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def next_date(self):
+        i = bisect.bisect_right(self.cumulative, self.rng.random() * self.cumulative[-1])
+        return date.fromordinal(self.ordinals[min(i, len(self.ordinals) - 1)]).isoformat()
+
+class DateRotations():
+    # Remembers where each DateIndex is in its pass through the dates, between activations,
+    # so short screensaver sessions don't keep showing the first dates of a new shuffle.
+    def __init__(self, filename, source):
+        self.filename = str(filename)
+        self.source = source
+        self.states = {}
+        self.indexes = {}
+        try:
+            with open(self.filename, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("source") == self.source:
+                self.states = data.get("scopes", {})
+        except Exception:
+            self.states = {}
+
+    def get_index(self, scope, dates):
+        state = self.states.get(scope)
+        try:
+            index = DateIndex(dates, state=state)
+        except Exception as e:
+            log(f"Discarding saved date rotation for {scope}: {type(e).__name__} {str(e)}")
+            index = DateIndex(dates)
+        self.indexes[scope] = index
+        return index
+
+    def save(self):
+        for scope, index in self.indexes.items():
+            self.states[scope] = index.get_state()
+        tmp_filename = self.filename + ".tmp"
+        try:
+            with open(tmp_filename, "w", encoding="utf-8") as f:
+                json.dump({"source": self.source, "scopes": self.states}, f, separators=(",", ":"))
+            os.replace(tmp_filename, self.filename)
+        except Exception as e:
+            log(f"Failed to save date rotation: {type(e).__name__} {str(e)}")
@@ -0,0 +1,68 @@
+import bisect
+import random
+from array import array
+from datetime import date
+
+# Which dates to show
+RANGE_ALL = 0
+RANGE_YEARS = 1
+RANGE_LAST_YEARS = 2
+
+class DateRange():
+    # The part of the timeline the show uses: everything, a range of years, or the last few years.
+    # The dates of an index are kept sorted, so the dates in the range are found with two bisects
+    # instead of checking every date. Dates are "YYYY-MM-DD" strings, which sort the same as dates.
+    # recency (0 to 1) favours the recent end of the range, the same way for every date source:
+    # a cutoff is drawn at random in the first part of the range (the whole range at 1), then a date
+    # (or a picture, without the database) after the cutoff is chosen. At 0 the whole range is used
+    # evenly; the higher it is, the more often older dates are left out.
+    def __init__(self, mode=RANGE_ALL, from_year=0, to_year=0, last_years=0, recency=0.0, today=None):
+        today = today if today is not None else date.today()
+        self.first = None
+        self.last = None
+        if mode == RANGE_YEARS:
+            self.first = date(max(min(from_year, to_year), 1), 1, 1).isoformat()
+            self.last = date(max(from_year, to_year, 1), 12, 31).isoformat()
+        elif mode == RANGE_LAST_YEARS:
+            try:
+                self.first = today.replace(year=today.year - last_years).isoformat()
+            except ValueError:
+                # February 29, and that year isn't a leap year
+                self.first = today.replace(year=today.year - last_years, day=28).isoformat()
+            self.last = today.isoformat()
+        self.recency = recency
+
+    def is_limited(self):
+        return self.first is not None or self.recency > 0
+
+    def contains(self, d):
+        d = str(d)[:10]
+        return (self.first is None or d >= self.first) and (self.last is None or d <= self.last)
+
+    def select(self, sorted_dates):
+        # The dates within the range, from a sorted list
+        lo = bisect.bisect_left(sorted_dates, self.first) if self.first is not None else 0
+        hi = bisect.bisect_right(sorted_dates, self.last) if self.last is not None else len(sorted_dates)
+        return sorted_dates[lo:hi]
+
+    def draw_cutoff(self, first, last, rng=None):
+        # The date to choose after, for a range of dates from first to last (ordinals)
+        rng = rng if rng is not None else random
+        return first + int((last - first) * rng.random() * self.recency)
+
+class RecentDates():
+    # Picks dates at random, with replacement, biased towards recent dates by the date range's recency.
+    # Each pick is a cutoff, a bisect to the last date on or before it, and a random date from there on.
+    def __init__(self, dates, date_range, rng=None):
+        self.ordinals = array('I', sorted(date.fromisoformat(str(d)).toordinal() for d in dates))
+        self.date_range = date_range
+        self.rng = rng if rng is not None else random
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def next_date(self):
+        ordinals = self.ordinals
+        cutoff = self.date_range.draw_cutoff(ordinals[0], ordinals[-1], self.rng)
+        i = max(bisect.bisect_right(ordinals, cutoff) - 1, 0)
+        return date.fromordinal(ordinals[self.rng.randrange(i, len(ordinals))]).isoformat()
@@ -0,0 +1,51 @@
+import json
+import os
+import time
+from .helpers import log
+
+# Forget dates after this long, for library changes the fingerprint doesn't catch (album edits, changed dates)
+MAX_AGE_SECONDS = 7 * 24 * 60 * 60
+
+class EmptyDates():
+    # Dates that had nothing to display (only videos, or formats that can't be shown) for a set of filters,
+    # kept between activations so they can be skipped without asking immich again.
+    # Everything is forgotten when the library fingerprint changes.
+    def __init__(self, filename, fingerprint):
+        self.filename = str(filename)
+        self.fingerprint = fingerprint
+        self.dates = {}
+        self.changed = False
+        try:
+            with open(self.filename, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("fingerprint") == self.fingerprint:
+                oldest = time.time() - MAX_AGE_SECONDS
+                self.dates = {
+                    filter_key: {d: t for d, t in dates.items() if t > oldest}
+                    for filter_key, dates in data.get("dates", {}).items()
+                }
+        except Exception:
+            self.dates = {}
+
+    def contains(self, filter_key, date):
+        return str(date) in self.dates.get(filter_key, {})
+
+    def add(self, filter_key, date):
+        self.dates.setdefault(filter_key, {})[str(date)] = time.time()
+        self.changed = True
+
+    def discard(self, filter_key, date):
+        if self.dates.get(filter_key, {}).pop(str(date), None) is not None:
+            self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        tmp_filename = self.filename + ".tmp"
+        try:
+            with open(tmp_filename, "w", encoding="utf-8") as f:
+                json.dump({"fingerprint": self.fingerprint, "dates": self.dates}, f, separators=(",", ":"))
+            os.replace(tmp_filename, self.filename)
+            self.changed = False
+        except Exception as e:
+            log(f"Failed to save empty dates: {type(e).__name__} {str(e)}")
@@ -0,0 +1,68 @@
+import random
+from array import array
+from datetime import datetime, timedelta, timezone
+
+# Postgres sends timestamps as microseconds since 2000-01-01 UTC
+POSTGRES_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+def merge_events(event_lists, gap_seconds):
+    # Combine the events of several scopes (e.g. albums) into the events of their union. Two events
+    # belong together if they overlap or are no more than the gap apart, the same rule the
+    # database uses for the pictures within a scope. Each event list is {"starts", "ends", "counts"}.
+    gap = gap_seconds * 1000000
+    events = sorted(
+        (start, end, count)
+        for event_list in event_lists
+        for start, end, count in zip(event_list["starts"], event_list["ends"], event_list["counts"])
+    )
+    merged = []
+    for start, end, count in events:
+        if merged and start - merged[-1][1] <= gap:
+            last = merged[-1]
+            last[1] = max(last[1], end)
+            # Pictures in more than one album are counted for each album
+            last[2] += count
+        else:
+            merged.append([start, end, count])
+    return {
+        "starts": [e[0] for e in merged],
+        "ends": [e[1] for e in merged],
+        "counts": [e[2] for e in merged],
+    }
+
+class EventIndex():
+    # Events are runs of pictures with no more than the gap between one picture and the next,
+    # so a trip or a party that goes past midnight is one event instead of parts of two dates.
+    # Each event is its first and last picture time (8 bytes each) and its number of pictures.
+    # Events are handed out in random order without repeats, one Fisher-Yates step per call,
+    # like DateIndex does for dates.
+    def __init__(self, events, min_count=1, date_range=None, rng=None):
+        keep = [
+            i for i, count in enumerate(events["counts"])
+            if count >= min_count and (date_range is None or date_range.contains(_iso_time(events["starts"][i])))
+        ]
+        self.starts = array('q', (events["starts"][i] for i in keep))
+        self.ends = array('q', (events["ends"][i] for i in keep))
+        self.order = array('I', range(len(keep)))
+        self.cursor = 0
+        self.rng = rng if rng is not None else random
+
+    def __len__(self):
+        return len(self.order)
+
+    def next_event(self):
+        # Returns the time range of the next event as (takenAfter, takenBefore) for the immich search
+        order = self.order
+        if self.cursor >= len(order):
+            # All of the events have been used, so start over
+            self.cursor = 0
+        j = self.rng.randrange(self.cursor, len(order))
+        order[self.cursor], order[j] = order[j], order[self.cursor]
+        chosen = order[self.cursor]
+        self.cursor += 1
+        # immich compares with millisecond times, so round the end up to include the last picture
+        return _iso_time(self.starts[chosen]), _iso_time(self.ends[chosen] + 999)
+
+def _iso_time(microseconds):
+    t = POSTGRES_EPOCH + timedelta(microseconds=microseconds)
+    return t.strftime("%Y-%m-%dT%H:%M:%S.") + f"{t.microsecond // 1000:03d}Z"
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+# Pictures taken within this many milliseconds of the one before are in the same group (a burst)
+BURST_GAP_MS = 2000
+
+EPOCH = datetime(1970, 1, 1)
+ONE_MS = timedelta(milliseconds=1)
+
+def taken_ms(local_date_time):
+    # immich's local date and time ("2024-05-01T10:11:12.345Z") as whole milliseconds, so it is
+    # parsed once when the picture is read instead of every time pictures are compared
+    return (datetime.fromisoformat(local_date_time.rstrip("Z")) - EPOCH) // ONE_MS
+
+def burst_ranges(times, gap_ms=BURST_GAP_MS):
+    # One pass over sorted times, returning each group as a (start, end) range of indexes, end excluded
+    ranges = []
+    start = 0
+    for i in range(1, len(times)):
+        if times[i] - times[i - 1] > gap_ms:
+            ranges.append((start, i))
+            start = i
+    if times:
+        ranges.append((start, len(times)))
+    return ranges
+
+def iter_bursts(images, gap_ms=BURST_GAP_MS):
+    # Like burst_ranges, for pictures that arrive in time order (e.g. a page at a time): each group
+    # is yielded as soon as a picture more than the gap after it shows that the group is complete.
+    # immich orders its results by UTC time, so the local times of a day with more than one time
+    # zone can go backwards; a picture earlier than the one before it also starts a new group.
+    image_group = []
+    for image in images:
+        if image_group and not 0 <= image["takenMs"] - image_group[-1]["takenMs"] <= gap_ms:
+            yield _sorted_group(image_group)
+            image_group = []
+        image_group.append(image)
+    if image_group:
+        yield _sorted_group(image_group)
+
+def _sorted_group(image_group):
+    # Pictures taken the same second are ordered by filename
+    image_group.sort(key=lambda x: (x["takenMs"], x["originalFileName"]))
+    return image_group
@@ -0,0 +1,89 @@
+import struct
+from .iptc import PHOTOSHOP_SIGNATURE, APP13, SOS, EOI, find_photoshop_iptc, iptc_fields
+
+# Reads the size and the IPTC fields of a picture from the start of its download, as the chunks
+# arrive, so the file doesn't have to be opened again once it is written. Only JPEG and PNG are
+# read this way; for anything else both are left as None and have to be read from the file.
+
+# Headers longer than this are not worth keeping in memory for
+MAX_HEADER_BYTES = 512 * 1024
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Start of frame markers, which hold the size of a JPEG (C4, C8 and CC are other markers)
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+class HeaderParser():
+    def __init__(self):
+        self.data = bytearray()
+        # Where the next JPEG segment starts
+        self.position = 2
+        self.photoshop = b""
+        self.done = False
+        # [width, height] and the IPTC fields, once known
+        self.size = None
+        self.iptc = None
+
+    def feed(self, chunk):
+        if self.done:
+            return
+        self.data += chunk[:MAX_HEADER_BYTES - len(self.data)]
+        try:
+            if self.data.startswith(PNG_SIGNATURE):
+                self._parse_png()
+            elif self.data[:2] == b"\xff\xd8":
+                self._parse_jpeg()
+            elif len(self.data) >= len(PNG_SIGNATURE):
+                self._finish()
+        except (struct.error, IndexError):
+            # Broken headers: leave it to the readers of the file
+            self.size = None
+            self.iptc = None
+            self._finish()
+        if len(self.data) >= MAX_HEADER_BYTES:
+            self._finish()
+
+    def close(self):
+        # The download is complete
+        if not self.done:
+            self._finish()
+
+    def _parse_png(self):
+        # The IHDR chunk always comes first
+        if len(self.data) >= 24:
+            self.size = list(struct.unpack_from(">II", self.data, 16))
+            self.iptc = {}
+            self._finish()
+
+    def _parse_jpeg(self):
+        data = self.data
+        pos = self.position
+        while pos + 4 <= len(data):
+            if data[pos] != 0xFF:
+                self._finish()
+                return
+            kind = data[pos + 1]
+            # Markers can be padded with any number of 0xFF
+            if kind == 0xFF:
+                pos += 1
+                continue
+            if kind in (SOS, EOI):
+                # Nothing but picture data from here on
+                self.iptc = iptc_fields(find_photoshop_iptc(self.photoshop) or b"")
+                self._finish()
+                return
+            end = pos + 2 + struct.unpack_from(">H", data, pos + 2)[0]
+            if kind == APP13 or kind in SOF_MARKERS:
+                if end > len(data):
+                    # Wait for the rest of the segment
+                    break
+                segment = bytes(data[pos + 4:end])
+                if kind in SOF_MARKERS:
+                    height, width = struct.unpack_from(">HH", segment, 1)
+                    self.size = [width, height]
+                elif segment.startswith(PHOTOSHOP_SIGNATURE):
+                    self.photoshop += segment[len(PHOTOSHOP_SIGNATURE):]
+            pos = end
+        self.position = pos
+
+    def _finish(self):
+        self.done = True
+        self.data = bytearray()
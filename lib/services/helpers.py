@@ -5,6 +5,9 @@ import xbmcaddon
 import xbmcgui
 
 ADDON = xbmcaddon.Addon().getAddonInfo('name')
+ADDON_ID = xbmcaddon.Addon().getAddonInfo('id')
+# Properties on the home window are visible to every part of the addon while kodi is running
+HOME_WINDOW_ID = 10000
 
 def log(msg, level=xbmc.LOGINFO):
     try:
@@ -17,3 +20,9 @@ def log(msg, level=xbmc.LOGINFO):
 
 def notify(heading, message="", level=xbmcgui.NOTIFICATION_ERROR, ms=5000):
     xbmcgui.Dialog().notification(heading, message, level, time=ms)
+
+def set_home_prop(name, value):
+    xbmcgui.Window(HOME_WINDOW_ID).setProperty(f"{ADDON_ID}.{name}", value)
+
+def get_home_prop(name):
+    return xbmcgui.Window(HOME_WINDOW_ID).getProperty(f"{ADDON_ID}.{name}")
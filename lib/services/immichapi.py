@@ -1,5 +1,6 @@
 import requests
 import json
+import urllib.parse
 import time
 import xbmc
 import xbmcaddon
@@ -23,12 +24,7 @@ class ImmichAPI:
         self.url = url.rstrip("/")
         self.abort_exception = abort_exception
         self.abort_function = abort_function
-        self.api_session = requests.Session()
-        self.api_session.headers.update({
-            "x-api-key": self.apikey,
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        })
+        self.api_session = self.new_session()
         self.download_file_session = requests.Session()
         self.download_file_session.headers.update({
             "x-api-key": self.apikey,
@@ -38,6 +34,17 @@ class ImmichAPI:
         })
         requests.packages.urllib3.disable_warnings()
 
+    def new_session(self):
+        # A session for api calls. Sessions aren't shared between threads, so a background thread
+        # gets its own (and closes it when done), and api_session is only used by the UI thread.
+        session = requests.Session()
+        session.headers.update({
+            "x-api-key": self.apikey,
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        })
+        return session
+
     def search_random(self,args):
         resp = self._api_call("POST", "/api/search/random", payload=args)
         return json.loads(resp.text)
@@ -46,6 +53,31 @@ class ImmichAPI:
         resp =self._api_call("GET", "/api/assets/"+assetUUID)
         return json.loads(resp.text)
 
+    def get_stack(self, stackId):
+        # The stack with all of its assets
+        resp = self._api_call("GET", "/api/stacks/"+stackId)
+        return json.loads(resp.text)
+
+    def get_statistics(self, isFavorite=None):
+        # Number of images and videos the user can see
+        endpoint = "/api/assets/statistics"
+        if isFavorite is not None:
+            endpoint += f"?isFavorite={str(isFavorite).lower()}"
+        resp = self._api_call("GET", endpoint)
+        return json.loads(resp.text)
+
+    def search_statistics(self, args):
+        # Number of assets the search would find, without fetching them
+        payload = {k: v for k, v in args.items() if k not in ("withExif", "order", "page", "size")}
+        resp = self._api_call("POST", "/api/search/statistics", payload=payload)
+        return json.loads(resp.text)["total"]
+
+    def get_timeline_buckets(self, args):
+        # Number of assets in each month
+        params = {"size": "MONTH", **args}
+        resp = self._api_call("GET", "/api/timeline/buckets?" + urllib.parse.urlencode(params))
+        return json.loads(resp.text)
+
     def get_albums(self):
         try: 
             resp = self._api_call("GET", "/api/albums")
@@ -53,11 +85,13 @@ class ImmichAPI:
         except:
             return None
 
-    def search_metadata(self, args):
+    def search_metadata(self, args, page_size=1000, page=1, session=None):
         payload = dict(args)
-        payload["size"] = 1000
+        payload["size"] = page_size
+        if page > 1:
+            payload["page"] = page
         while True:
-            resp = self._api_call("POST", "/api/search/metadata", payload=payload)
+            resp = self._api_call("POST", "/api/search/metadata", payload=payload, session=session)
             data = resp.json()
             yield data["assets"]["items"]
             next_page = data["assets"]["nextPage"]
@@ -65,7 +99,7 @@ class ImmichAPI:
                 break
             payload["page"] = next_page
 
-    def _api_call(self,method, endpoint, payload=None):
+    def _api_call(self,method, endpoint, payload=None, session=None):
         notify_header = ""
         notify_message = ""
         log_message = ""
@@ -77,7 +111,7 @@ class ImmichAPI:
                 # User requested end of show
                 raise self.abort_exception()
             try:
-                resp = self.api_session.request(method, self.url + endpoint, json=payload, timeout=timeout)
+                resp = (session or self.api_session).request(method, self.url + endpoint, json=payload, timeout=timeout)
                 if resp.status_code == 401:
                     # Handle Auth error
                     notify_header = ADDON.getLocalizedString(AUTHORIZATION_ERROR)
@@ -121,7 +155,8 @@ class ImmichAPI:
         notify(notify_header,notify_message)
         raise self.abort_exception()
 
-    def download_file(self, fileUUID, local_filename, mime_type=None, use_preview=False):
+    def download_file(self, fileUUID, local_filename, mime_type=None, use_preview=False, headers=None):
+        # headers, if given, is a HeaderParser that is fed the start of the file as it arrives
         if use_preview or mime_type.lower().endswith(("heic", "heif")):
             # If HEIC/HEIF, get thumbnail - kodi doesn't support these
             url = f"{self.url}/api/assets/{fileUUID}/thumbnail?size=preview"
@@ -138,6 +173,10 @@ class ImmichAPI:
                         raise self.abort_exception()
                     if chunk:
                         f.write(chunk)
+                        if headers is not None:
+                            headers.feed(chunk)
+            if headers is not None:
+                headers.close()
             return True
         except Exception as e:
             return False
@@ -0,0 +1,143 @@
+import struct
+
+# Reads the few IPTC fields shown on the slides straight from the headers of a JPEG or TIFF file,
+# without reading the picture itself. In a JPEG the IPTC data is in a Photoshop APP13 segment,
+# which comes before the picture data; in a TIFF it is an IFD0 tag (or inside the Photoshop tag).
+
+# The record 2 datasets shown on the slides
+IPTC_FIELDS = {
+    "Headline": 105,
+    "Caption": 120,
+    "Sublocation": 92,
+    "City": 90,
+    "State": 95,
+    "Country": 101,
+}
+PHOTOSHOP_SIGNATURE = b"Photoshop 3.0\x00"
+PHOTOSHOP_IPTC_RESOURCE = 0x0404
+TIFF_IPTC_TAG = 33723
+TIFF_PHOTOSHOP_TAG = 34377
+# IPTC or Photoshop blocks bigger than this are taken to be broken rather than read into memory
+MAX_BLOCK_SIZE = 4 * 1024 * 1024
+# Bytes per value of each TIFF field type
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+# JPEG markers
+SOI = 0xD8
+EOI = 0xD9
+SOS = 0xDA
+APP13 = 0xED
+
+def read_iptc(filename):
+    # The IPTC fields of the file as text, by name. Empty if there are none or the file can't be read.
+    try:
+        with open(filename, "rb") as f:
+            start = f.read(4)
+            if start[:2] == bytes((0xFF, SOI)):
+                f.seek(2)
+                data = _jpeg_iptc(f)
+            elif start in (b"II*\x00", b"MM\x00*"):
+                data = _tiff_iptc(f, "<" if start[:2] == b"II" else ">")
+            else:
+                data = None
+    except (OSError, struct.error, IndexError, ValueError, MemoryError):
+        return {}
+    return iptc_fields(data) if data else {}
+
+def iptc_fields(data):
+    # The fields shown on the slides, from an IPTC block
+    datasets = parse_iptc(data)
+    fields = {}
+    for name, dataset in IPTC_FIELDS.items():
+        if datasets.get(dataset):
+            fields[name] = _decode(datasets[dataset])
+    return fields
+
+def parse_iptc(data):
+    # The record 2 datasets of an IPTC block, by number. Of repeated datasets the last is kept.
+    datasets = {}
+    pos = 0
+    while pos + 5 <= len(data) and data[pos] == 0x1C:
+        record = data[pos + 1]
+        dataset = data[pos + 2]
+        size = struct.unpack_from(">H", data, pos + 3)[0]
+        pos += 5
+        if size & 0x8000:
+            # Extended dataset: the size is in the next (size & 0x7FFF) bytes
+            count = size & 0x7FFF
+            size = int.from_bytes(data[pos:pos + count], "big")
+            pos += count
+        if record == 2:
+            datasets[dataset] = bytes(data[pos:pos + size])
+        pos += size
+    return datasets
+
+def find_photoshop_iptc(data):
+    # The IPTC block in Photoshop image resource blocks, or None if it isn't there (or not all there yet)
+    pos = 0
+    while pos + 8 <= len(data) and data[pos:pos + 4] == b"8BIM":
+        resource = struct.unpack_from(">H", data, pos + 4)[0]
+        # The name is a pascal string, padded to an even length
+        pos += 6 + ((data[pos + 6] + 2) & ~1)
+        if pos + 4 > len(data):
+            return None
+        size = struct.unpack_from(">I", data, pos)[0]
+        pos += 4
+        if resource == PHOTOSHOP_IPTC_RESOURCE:
+            return bytes(data[pos:pos + size]) if pos + size <= len(data) else None
+        pos += size + (size & 1)
+    return None
+
+def _jpeg_iptc(f):
+    # Walks the segments up to the picture data, skipping over all but APP13. A big IPTC block can be
+    # split over several APP13 segments, each with the Photoshop signature.
+    photoshop = b""
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        kind = marker[1]
+        # Markers can be padded with any number of 0xFF
+        while kind == 0xFF:
+            kind = f.read(1)[0]
+        if kind in (SOS, EOI):
+            return None
+        size = struct.unpack(">H", f.read(2))[0] - 2
+        if kind != APP13:
+            f.seek(size, 1)
+            continue
+        segment = f.read(size)
+        if segment.startswith(PHOTOSHOP_SIGNATURE):
+            photoshop += segment[len(PHOTOSHOP_SIGNATURE):]
+            iptc = find_photoshop_iptc(photoshop)
+            if iptc is not None:
+                return iptc
+
+def _tiff_iptc(f, order):
+    # Only the entries of IPTC and Photoshop tags in the first IFD are read
+    f.seek(4)
+    f.seek(struct.unpack(order + "I", f.read(4))[0])
+    count = struct.unpack(order + "H", f.read(2))[0]
+    entries = f.read(count * 12)
+    photoshop = None
+    for i in range(count):
+        tag, kind, values, value = struct.unpack_from(order + "HHI4s", entries, i * 12)
+        if tag not in (TIFF_IPTC_TAG, TIFF_PHOTOSHOP_TAG):
+            continue
+        size = values * TIFF_TYPE_SIZES.get(kind, 1)
+        if size > MAX_BLOCK_SIZE:
+            return None
+        if size <= 4:
+            data = value[:size]
+        else:
+            f.seek(struct.unpack(order + "I", value)[0])
+            data = f.read(size)
+        if tag == TIFF_IPTC_TAG:
+            return data
+        photoshop = data
+    return find_photoshop_iptc(photoshop) if photoshop else None
+
+def _decode(raw):
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode("latin-1", errors="replace")
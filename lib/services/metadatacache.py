@@ -0,0 +1,71 @@
+import json
+import sqlite3
+import threading
+import time
+from .helpers import log
+
+# Bump whenever the layout of the stored metadata changes, so old entries are dropped
+SCHEMA_VERSION = 2
+# Pictures remembered at most; the ones shown longest ago are forgotten first
+MAX_ENTRIES = 50000
+
+class MetadataCache():
+    # What was read from the file of each picture shown (its size and IPTC fields), kept between
+    # activations so a picture shown before needs no parsing. Entries are keyed by asset id and
+    # checksum, so a picture whose file was replaced in immich is read again, and kept apart for the
+    # preview and the original, which are different files.
+    # Used from the slide worker, so every access holds the lock.
+    def __init__(self, filename, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        try:
+            self.db = sqlite3.connect(str(filename), check_same_thread=False)
+            if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                self.db.execute("DROP TABLE IF EXISTS assets")
+                self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.db.execute("CREATE TABLE IF NOT EXISTS assets (id TEXT, preview INTEGER, checksum TEXT, used REAL, metadata TEXT, PRIMARY KEY (id, preview))")
+            self.db.commit()
+        except sqlite3.Error as e:
+            log(f"Metadata cache not available: {type(e).__name__} {str(e)}")
+            self.db = None
+
+    def get(self, asset_id, checksum, preview):
+        # The stored metadata, or None if the picture hasn't been seen (or has changed since)
+        if self.db is None or not checksum:
+            return None
+        with self.lock:
+            try:
+                key = (asset_id, int(preview))
+                row = self.db.execute("SELECT checksum, metadata FROM assets WHERE id = ? AND preview = ?", key).fetchone()
+                if row is None or row[0] != checksum:
+                    return None
+                self.db.execute("UPDATE assets SET used = ? WHERE id = ? AND preview = ?", (time.time(),) + key)
+                return json.loads(row[1])
+            except (sqlite3.Error, ValueError) as e:
+                log(f"Metadata cache read failed: {type(e).__name__} {str(e)}")
+                return None
+
+    def put(self, asset_id, checksum, preview, metadata):
+        if self.db is None or not checksum:
+            return
+        with self.lock:
+            try:
+                self.db.execute("INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?, ?)",
+                                (asset_id, int(preview), checksum, time.time(), json.dumps(metadata, separators=(",", ":"))))
+                self.db.commit()
+            except sqlite3.Error as e:
+                log(f"Metadata cache write failed: {type(e).__name__} {str(e)}")
+
+    def close(self):
+        # Keep the cache to its size, and save when the pictures were last used
+        if self.db is None:
+            return
+        with self.lock:
+            try:
+                self.db.execute("DELETE FROM assets WHERE rowid NOT IN (SELECT rowid FROM assets ORDER BY used DESC LIMIT ?)",
+                                (self.max_entries,))
+                self.db.commit()
+                self.db.close()
+            except sqlite3.Error as e:
+                log(f"Metadata cache close failed: {type(e).__name__} {str(e)}")
+            self.db = None
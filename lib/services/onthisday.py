@@ -0,0 +1,55 @@
+from datetime import date, timedelta
+from .dateindex import DateIndex
+from .helpers import log
+
+# Look at neighbouring days until there are at least this many dates to choose from
+MIN_DATES = 5
+# but never further away than this many days
+MAX_WINDOW_DAYS = 7
+# A leap year, so every month and day (including February 29) can be turned into a date
+LEAP_YEAR = 2000
+
+def month_days_around(today, window):
+    # The (month, day) pairs within window days of today
+    center = date(LEAP_YEAR, today.month, today.day)
+    return [((center + timedelta(days=k)).month, (center + timedelta(days=k)).day) for k in range(-window, window + 1)]
+
+class OnThisDay():
+    # Chooses dates from earlier years that fall on today's month and day. The dates are indexed
+    # by (month, day), so finding the candidates for a day is a dictionary lookup. When a day has
+    # few pictures, the days around it are used too.
+    def __init__(self, dates):
+        self.all_dates = list(dates)
+        self.by_month_day = {}
+        for d in self.all_dates:
+            d = str(d)
+            self.by_month_day.setdefault((int(d[5:7]), int(d[8:10])), []).append(d)
+        self.today = None
+        self.index = None
+
+    def __len__(self):
+        return len(self.all_dates)
+
+    def next_date(self):
+        today = date.today()
+        if today != self.today:
+            # It's a new day (or the first date of the show), so find the dates for today
+            self.today = today
+            self.index = DateIndex(self._candidates(today))
+        return self.index.next_date()
+
+    def _candidates(self, today):
+        candidates = []
+        for window in range(MAX_WINDOW_DAYS + 1):
+            candidates = [
+                d
+                for month_day in month_days_around(today, window)
+                for d in self.by_month_day.get(month_day, [])
+                if int(d[:4]) < today.year
+            ]
+            if len(candidates) >= MIN_DATES:
+                break
+        if not candidates:
+            log("No pictures from earlier years around today's date, using all dates")
+            candidates = self.all_dates
+        return candidates
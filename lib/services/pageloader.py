@@ -0,0 +1,59 @@
+import queue
+import threading
+
+# Pages fetched ahead of the show, at most
+MAX_QUEUED_PAGES = 4
+
+class PageLoader():
+    # Fetches the pages of a search in a background thread, so the show can start on the first
+    # page while the rest are still loading. Iterating gives the pages in order. Errors in the
+    # thread (including the abort exception) are raised where the pages are used.
+    def __init__(self, pages, abort_exception, abort_function):
+        self.abort_exception = abort_exception
+        self.abort_function = abort_function
+        self.queue = queue.Queue(MAX_QUEUED_PAGES)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._load, args=(pages,), daemon=True)
+        self.thread.start()
+
+    def __iter__(self):
+        while True:
+            try:
+                kind, value = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                if self.abort_function():
+                    self.stop()
+                    raise self.abort_exception()
+                continue
+            if kind == "done":
+                return
+            if kind == "error":
+                raise value
+            yield value
+
+    def stop(self):
+        # Stop fetching, and wait for a request that is under way so its session can be closed.
+        # When the show is ending there is nothing to wait for.
+        self.stopped.set()
+        if not self.abort_function():
+            self.thread.join(timeout=5)
+
+    def _load(self, pages):
+        try:
+            for page in pages:
+                if self.stopped.is_set() or not self._put(("page", page)):
+                    return
+        except BaseException as e:
+            self._put(("error", e))
+            return
+        self._put(("done", None))
+
+    def _put(self, item):
+        # Wait for room in the queue, unless the pages are no longer wanted
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
@@ -0,0 +1,36 @@
+import random
+
+class AliasSampler():
+    # Picks an index at random with probability proportional to its weight, in O(1) per pick
+    # (Vose's alias method). Setting up the tables is O(n), once.
+    def __init__(self, weights, rng=None):
+        self.rng = rng if rng is not None else random
+        n = len(weights)
+        total = float(sum(weights))
+        if total <= 0:
+            # Nothing to go by, so every index is equally likely
+            weights = [1] * n
+            total = float(n)
+        scaled = [w * n / total for w in weights]
+        self.probability = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.probability[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        # Whatever is left over is 1.0, give or take rounding
+
+    def __len__(self):
+        return len(self.probability)
+
+    def draw(self):
+        i = self.rng.randrange(len(self.probability))
+        return i if self.rng.random() < self.probability[i] else self.alias[i]
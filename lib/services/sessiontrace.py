@@ -0,0 +1,51 @@
+import json
+from .helpers import log
+
+# A session trace is a JSON line with the random seed, then a JSON line for each date (or event) shown:
+# its time range, the albums searched, the offset into its groups, and the ids of the pictures shown.
+
+class SessionRecorder():
+    # Writes the trace of a session as it goes, so it is complete up to the last date shown
+    # even if kodi is stopped
+    def __init__(self, filename, seed):
+        self.file = open(str(filename), "w", encoding="utf-8")
+        self._write({"seed": seed})
+
+    def record(self, entry):
+        self._write(entry)
+
+    def close(self):
+        self.file.close()
+
+    def _write(self, entry):
+        self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self.file.flush()
+
+class SessionReplay():
+    # Hands out the dates of a recorded session in order, and counts the dates where
+    # the pictures are not the ones recorded (the library has changed since)
+    def __init__(self, filename):
+        with open(str(filename), "r", encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        if not lines or "seed" not in lines[0]:
+            raise ValueError("Not a session trace")
+        self.seed = lines[0]["seed"]
+        self.entries = lines[1:]
+        self.position = 0
+        self.mismatches = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def next_entry(self):
+        # None when the whole session has been replayed
+        if self.position >= len(self.entries):
+            return None
+        self.position += 1
+        return self.entries[self.position - 1]
+
+    def check(self, assets):
+        entry = self.entries[self.position - 1]
+        if assets != entry["assets"]:
+            self.mismatches += 1
+            log(f"Replay: different pictures than recorded for {entry['takenAfter']} - {entry['takenBefore']}")
@@ -0,0 +1,174 @@
+import base64
+import math
+import struct
+import zlib
+from collections import deque
+
+# ThumbHash (https://evanw.github.io/thumbhash/) is a tiny DCT of a picture: the average colour and
+# a few cosine coefficients for luminance (L), two colour channels (P, Q) and optionally alpha.
+# immich sends it with every asset, base64 encoded.
+
+# Pictures more than this far apart in time are never treated as near-duplicates of each other
+DUPLICATE_WINDOW_MS = 10 * 60 * 1000
+# Each picture is compared with at most this many of the pictures kept before it
+MAX_COMPARED = 16
+
+def decode(thumbhash):
+    # The thumbhash constants and coefficients, or None if it can't be read
+    try:
+        h = base64.b64decode(thumbhash)
+        header24 = h[0] | (h[1] << 8) | (h[2] << 16)
+        header16 = h[3] | (h[4] << 8)
+        has_alpha = header24 >> 23
+        # With alpha, a sixth header byte holds its constants
+        alpha_header = h[5] if has_alpha else 0
+    except Exception:
+        return None
+    is_landscape = header16 >> 15
+    t = {
+        "l_dc": (header24 & 63) / 63,
+        "p_dc": ((header24 >> 6) & 63) / 31.5 - 1,
+        "q_dc": ((header24 >> 12) & 63) / 31.5 - 1,
+        "has_alpha": has_alpha,
+        "lx": max(3, (5 if has_alpha else 7) if is_landscape else header16 & 7),
+        "ly": max(3, header16 & 7 if is_landscape else (5 if has_alpha else 7)),
+        "a_dc": (alpha_header & 15) / 15 if has_alpha else 1,
+    }
+    l_scale = ((header24 >> 18) & 31) / 31
+    p_scale = ((header16 >> 3) & 63) / 63
+    q_scale = ((header16 >> 9) & 63) / 63
+    a_scale = (alpha_header >> 4) / 15
+    ac_start = 6 if has_alpha else 5
+    ac_index = 0
+
+    def decode_channel(nx, ny, scale):
+        nonlocal ac_index
+        ac = []
+        for cy in range(ny):
+            cx = 0 if cy else 1
+            while cx * ny < nx * (ny - cy):
+                ac.append((((h[ac_start + (ac_index >> 1)] >> ((ac_index & 1) << 2)) & 15) / 7.5 - 1) * scale)
+                ac_index += 1
+                cx += 1
+        return ac
+
+    try:
+        t["l_ac"] = decode_channel(t["lx"], t["ly"], l_scale)
+        # Boost saturation by 1.25x to make up for the quantization
+        t["p_ac"] = decode_channel(3, 3, p_scale * 1.25)
+        t["q_ac"] = decode_channel(3, 3, q_scale * 1.25)
+        t["a_ac"] = decode_channel(5, 5, a_scale) if has_alpha else []
+    except IndexError:
+        # Too short
+        return None
+    return t
+
+def approximate_aspect_ratio(t):
+    return t["lx"] / t["ly"]
+
+def to_rgba(thumbhash):
+    # Draws the thumbhash as a picture of at most 32x32 pixels. Returns (width, height, rgba bytes),
+    # or None if the thumbhash can't be read.
+    t = decode(thumbhash) if thumbhash else None
+    if t is None:
+        return None
+    ratio = approximate_aspect_ratio(t)
+    w = round(32 if ratio > 1 else 32 * ratio)
+    h = round(32 / ratio if ratio > 1 else 32)
+    lx, ly, has_alpha = t["lx"], t["ly"], t["has_alpha"]
+    nx = max(lx, 5 if has_alpha else 3)
+    ny = max(ly, 5 if has_alpha else 3)
+    # The cosines only depend on the column or the row, so work them out once
+    fxs = [[math.cos(math.pi / w * (x + 0.5) * cx) for cx in range(nx)] for x in range(w)]
+    fys = [[math.cos(math.pi / h * (y + 0.5) * cy) * 2 for cy in range(ny)] for y in range(h)]
+    l_terms = _terms(lx, ly, t["l_ac"])
+    pq_terms = _terms(3, 3, list(zip(t["p_ac"], t["q_ac"])))
+    a_terms = _terms(5, 5, t["a_ac"]) if has_alpha else []
+    rgba = bytearray(w * h * 4)
+    i = 0
+    for fy in fys:
+        for fx in fxs:
+            l = t["l_dc"]
+            for cx, cy, ac in l_terms:
+                l += ac * fx[cx] * fy[cy]
+            p = t["p_dc"]
+            q = t["q_dc"]
+            for cx, cy, (p_ac, q_ac) in pq_terms:
+                f = fx[cx] * fy[cy]
+                p += p_ac * f
+                q += q_ac * f
+            a = t["a_dc"]
+            for cx, cy, ac in a_terms:
+                a += ac * fx[cx] * fy[cy]
+            # Convert to RGB
+            b = l - 2 / 3 * p
+            r = (3 * l - b + q) / 2
+            g = r - q
+            rgba[i] = _to_byte(r)
+            rgba[i + 1] = _to_byte(g)
+            rgba[i + 2] = _to_byte(b)
+            rgba[i + 3] = _to_byte(a)
+            i += 4
+    return w, h, bytes(rgba)
+
+def write_png(thumbhash, filename):
+    # Writes the thumbhash as a small PNG file. Returns False if the thumbhash can't be read.
+    picture = to_rgba(thumbhash)
+    if picture is None:
+        return False
+    w, h, rgba = picture
+    # Each row starts with filter type 0 (none)
+    rows = b"".join(b"\x00" + rgba[y * w * 4:(y + 1) * w * 4] for y in range(h))
+    with open(filename, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(_png_chunk(b"IHDR", struct.pack("!IIBBBBB", w, h, 8, 6, 0, 0, 0)))
+        f.write(_png_chunk(b"IDAT", zlib.compress(rows, 6)))
+        f.write(_png_chunk(b"IEND", b""))
+    return True
+
+def _terms(nx, ny, ac):
+    # The (column, row) of each coefficient, in the order they are stored
+    positions = [(cx, cy) for cy in range(ny) for cx in range(0 if cy else 1, nx) if cx * ny < nx * (ny - cy)]
+    return [(cx, cy, value) for (cx, cy), value in zip(positions, ac)]
+
+def _to_byte(value):
+    return max(0, min(255, int(255 * value)))
+
+def _png_chunk(kind, data):
+    return struct.pack("!I", len(data)) + kind + data + struct.pack("!I", zlib.crc32(kind + data) & 0xffffffff)
+
+def signature(thumbhash):
+    # A small vector to compare pictures by: the average colour and the luminance coefficients.
+    # The coefficients are a cosine transform, so the difference between two vectors follows the
+    # difference between the pictures without having to draw them. None if there is no thumbhash.
+    t = decode(thumbhash) if thumbhash else None
+    if t is None:
+        return None
+    return (t["lx"], t["ly"]), [t["l_dc"], t["p_dc"], t["q_dc"]] + t["l_ac"]
+
+def distance(a, b):
+    # Mean difference between the vectors, in percent. Pictures with different shapes are never close.
+    if a[0] != b[0]:
+        return 100.0
+    return 100.0 * sum(abs(x - y) for x, y in zip(a[1], b[1])) / len(a[1])
+
+class NearDuplicates():
+    # Spots pictures that look almost the same as one kept shortly before them, so they can be left
+    # out of the show before anything is downloaded. Pictures must be checked in time order.
+    def __init__(self, threshold, window_ms=DUPLICATE_WINDOW_MS):
+        self.threshold = threshold
+        self.window_ms = window_ms
+        self.kept = deque(maxlen=MAX_COMPARED)
+
+    def is_duplicate(self, image):
+        taken = image["takenMs"]
+        while self.kept and taken - self.kept[0][0] > self.window_ms:
+            self.kept.popleft()
+        image_signature = signature(image.get("thumbhash"))
+        if image_signature is None:
+            return False
+        for kept_taken, kept_signature in self.kept:
+            if distance(image_signature, kept_signature) <= self.threshold:
+                return True
+        self.kept.append((taken, image_signature))
+        return False
@@ -0,0 +1,4 @@
+from lib import dateservice
+
+if __name__ == '__main__':
+    dateservice.DateService().run()